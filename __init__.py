@@ -11,12 +11,22 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import caldav
-import hashlib
+import heapq
+import itertools
 import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from .peg import parser
-from tatsu.util import asjson
+from .peg import parser, FastMatcher
+from .ncal import CalDAVPool, EventStore, PrefetchScheduler, syncCalendar, calendarQuery, parseEvents, startKey
+from .ncal import isRecurring, iterOccurrences, TimeRangeResolver
+from .ncal import freeBusyQuery, mergeIntervals, clipIntervals, freeBlocks, totalDuration, isAllDay
+from .ncal import findFreeSlots, eventUID, putEvents, Outbox, WriteError, Rejected, digestEvents, Tracer, traced
+from .ncal import LoopThread, cancellable, CircuitOpen, Unavailable, currentDeadline, deadline, withDeadline
+from .ncal import CalendarDirectory, calendarCollections, importEvents, exportEvents
 from datetime import datetime as dt
 from datetime import timedelta
 from datetime import timezone
@@ -26,10 +36,27 @@ from mycroft.skills.core import intent_handler
 from mycroft.util.parse import extract_duration, extract_datetime, normalize
 from mycroft.util.time import default_timezone
 
+SYNC_MAX_AGE = 300                                                              # seconds before the local event store is re-synced
+EVENT_PAUSE = 0.3                                                               # seconds of silence between spoken events
+FREE_HOURS = (8, 20)                                                            # free blocks are only reported within these hours
+MIN_FREE_BLOCK = timedelta(minutes=15)                                          # shorter gaps are not worth mentioning
+DEFAULT_SLOT = timedelta(minutes=30)                                            # slot length when none is spoken
+PREFETCH_WINDOWS = ['today', 'tomorrow', 'this week', 'this weekend']           # time frames kept warm by the prefetcher
+DIGEST_THRESHOLD = 8                                                            # longer results are summarised per day
+DIGEST_ITEMS = 2                                                                # events named for each day of a digest
+INTENT_DEADLINE = 6                                                             # seconds an intent may spend waiting on the server
+OUTBOX_INTERVAL = 30                                                            # seconds between attempts to flush queued events
+BULK_WORKERS = 4                                                                # concurrent PUTs of an .ics import
+SHUTDOWN_TIMEOUT = 10                                                           # seconds shutdown waits for a background thread
+# the one or two words naming whose calendar an utterance is about ("grandma calendar")
+CALENDAR_WORDS_RE = re.compile(r'((?:\w+ )?\w+) (?:calendar|schedule|agenda|planner|events)\b')
+
 class NextcloudCalendarSkill(MycroftSkill):
     def __init__(self):
         super(NextcloudCalendarSkill, self).__init__(name="NextcloudCalendarSkill")
         
+        # the two dictionaries below are only used until the calendars have been
+        # discovered from the server; after that they come from self.directory
         # dictionary to convert calendar names to corresponding possessives
         self.calendarToName = {'madison-1':"madison's",'personal':'your','milo':"milo's"}
         # dictionary to convert possible possessives to corresponding calendar names
@@ -40,11 +67,98 @@ class NextcloudCalendarSkill(MycroftSkill):
                           "me":"personal", "my":"personal", "i":"personal",
                           "mine":"personal", "myself":"personal", "my own": "personal",
                           "9": "personal", "mind": "personal"}
-        # init custom timeframe and calendar owner parser
-        self.PEGParser = parser()
+        # restored when the account changes, until its calendars are discovered
+        self._fallbackOwners = (dict(self.calendarToName), dict(self.nameToCalendar))
+        # possessives that refer to every calendar in the household
+        self.householdOwners = {"the", "the family", "family", "everyone", "everybody"}
+        # custom timeframe and calendar owner parser; importing tatsu and building the
+        # parser is slow, so it happens on first use (or in the background after initialize)
+        self._PEGParser = None
+        self._parserLock = threading.Lock()
+        # regex compiled from the same grammar, tried before the PEG parser
+        self.fastMatcher = FastMatcher()
+        # maps time frames like "this weekend" to [start, end) windows, memoised until midnight
+        self.timeRangeResolver = TimeRangeResolver(tz=default_timezone())
+        # long-lived caldav clients and calendars, shared across intents
+        self.calDAVPool = CalDAVPool()
+        self._configs = None
+        # worker threads for querying several calendars at once
+        self.executor = ThreadPoolExecutor(max_workers=self.calDAVPool.max_connections)
+        # separate workers for .ics imports, so their batches never queue ahead of intent queries
+        self.bulkExecutor = ThreadPoolExecutor(max_workers=BULK_WORKERS, thread_name_prefix='calendar-bulk')
+        # event loop the handlers hand their server queries to, so stop() can cancel them
+        self.loopThread = None
+        # set by stop() to interrupt a readout in progress; cleared when an intent starts
+        self._stopSpeaking = threading.Event()
+        self._readingOut = False
+        # one sync at a time per calendar url
+        self._syncLocks = {}
+        self._syncLocksLock = threading.Lock()
+        # (calendar names, start, end) of the last digest, for "tell me more about tuesday"
+        self._lastDigest = None
+        # per-stage latency histograms of the intents; written to latency.prom once initialized
+        self.tracer = Tracer()
+    
+    def initialize(self):
+        self.settings_change_callback = self.on_settings_changed
+        self.loopThread = LoopThread().start()
+        self.executor.submit(lambda: self.PEGParser)                            # build the parser off the loading thread
+        # local copy of the calendars, kept in the skill's data dir so it survives reloads
+        self.eventStore = EventStore(os.path.join(self.file_system.path, 'events.db'),
+                                     tz=default_timezone())
+        # calendars discovered from the server and their spoken aliases, saved across reloads
+        self.directory = CalendarDirectory(os.path.join(self.file_system.path, 'calendars.json'))
+        self.applyDirectory()
+        # keep the common time frames warm so list queries never wait on the server
+        self.prefetcher = PrefetchScheduler(self.prefetchCalendars, interval=self.refreshInterval())
+        self.prefetcher.start()
+        # events are journaled here first and written to the server in the background
+        self.outbox = Outbox(os.path.join(self.file_system.path, 'outbox.jsonl'))
+        self.flusher = PrefetchScheduler(self.flushOutbox, interval=OUTBOX_INTERVAL, name='calendar-outbox')
+        self.flusher.start()
+        self.tracer.path = os.path.join(self.file_system.path, 'latency.prom')
+        self.add_event('skill.nextcloud-calendar.latency', self.handle_latency_request)
+        self.add_event('skill.nextcloud-calendar.import', self.handle_import_request)
+        self.add_event('skill.nextcloud-calendar.export', self.handle_export_request)
+    
+    @property
+    def PEGParser(self):
+        with self._parserLock:
+            if self._PEGParser is None:
+                self._PEGParser = parser()
+            return self._PEGParser
+    
+    # drop cached configs so the next intent uses the new settings, and the connections,
+    # breakers and discovered calendars only if the account itself changed
+    def on_settings_changed(self):
+        previous = self._configs
+        self._configs = None
+        if previous is not None and self.getConfigs() != previous:              # server_url, user or password
+            self.calDAVPool.clear()
+            self.directory.reset()                                              # may be a different account now
+            self.calendarToName, self.nameToCalendar = (dict(d) for d in self._fallbackOwners)
+        self.prefetcher.interval = self.refreshInterval()
+        self.prefetcher.wake()
+        self.flusher.wake()
+    
+    # seconds between background refreshes of the known calendars
+    def refreshInterval(self):
+        try:
+            return max(1.0, float(self.settings.get('refresh_interval', 5))) * 60
+        except (TypeError, ValueError):
+            return SYNC_MAX_AGE
+    
+    # results with more events than this are read as a per-day digest
+    def digestThreshold(self):
+        try:
+            return max(1, int(self.settings.get('digest_threshold', DIGEST_THRESHOLD)))
+        except (TypeError, ValueError):
+            return DIGEST_THRESHOLD
     
     # get skill configurations from home.mycroft.ai or from local settings
     def getConfigs(self):
+        if self._configs is not None:                                           # configs are cached until settings change
+            return self._configs
         try:
             config = self.config_core.get("NextcloudCalendarSkill", {})
             if not config == {}:
@@ -57,7 +171,8 @@ class NextcloudCalendarSkill(MycroftSkill):
                 user = str(self.settings.get("user"))
                 password = str(self.settings.get("password"))
             
-            return server_url, user, password
+            self._configs = (server_url, user, password)
+            return self._configs
         except Exception as e:
             self.speak_dialog('settings.error')
             self.log.error(e)
@@ -65,6 +180,15 @@ class NextcloudCalendarSkill(MycroftSkill):
     
     # convert the spoken time range to start and end datetime objects
     def convertSpokenTimeRangeToDT(self, time_range_string):
+        window = self.timeRangeResolver.resolve(time_range_string)              # fixed phrases come straight from the table
+        if window is not None:
+            now = self.timeRangeResolver.clock()
+            if window[0] < now < window[1]:                                     # "today", "this week": what has already
+                window = (now, window[1])                                       # passed is left out, as before
+            self.log.info("start: {}".format(window[0]))
+            self.log.info("end: {}".format(window[1]))
+            return window
+        
         time_range_list = time_range_string.split(' ')
         # attempt to get starting datetime directly
         try:
@@ -133,7 +257,7 @@ class NextcloudCalendarSkill(MycroftSkill):
         tstamp = dt.now(tz=timezone.utc).strftime("%Y%m%dT%H%M%SZ")             # get current time for timestamp
         start_utc = start.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")   # convert start and end from local to utc
         end_utc = end.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")       # since nextcloud calendar uses UTC
-        _id = hashlib.sha1(bytes(tstamp+name,'utf-8')).hexdigest()              # SHA-1 the timestamp+name to give a unique ID
+        _id = eventUID(name, start_utc, end_utc, rule)                          # SHA-1 of the event details, so retries are idempotent
         if rule is not None:                                                    # by default, no repition.
             rrule = "FREQ={}\n".format(rule)
         else:
@@ -153,61 +277,541 @@ END:VCALENDAR
         s = s.format(_id, tstamp, start_utc, end_utc, rrule, name)
         return s
     
-    # create event in nextcloud calendar
-    def makeEvent(self, calendarObj, start, end, name, rule=None, owner='your'):
-        eventString = self.makeEventString(name, start, end, rule=rule)         # create the ical string
+    # create many events (dicts with name, start, end and optional rule) in one calendar,
+    # sending the PUTs concurrently over the pooled session. Since UIDs come from the event
+    # details and PUTs use If-None-Match, retrying a batch never creates duplicates.
+    # Returns [(uid, 'created' | 'exists' | exception)] in the order given
+    def makeEvents(self, calendarObj, events):
+        items = [(self.uidOf(e), self.makeEventString(e['name'], e['start'], e['end'], rule=e.get('rule')))
+                 for e in events]
+        results = putEvents(calendarObj.client, str(calendarObj.url), items, self.executor)
+        self.executor.submit(self.refreshCalendar, self.backgroundCalendar(calendarObj)) # pick the new events up in the local store
+        return results
+    
+    # the uid makeEventString gives an event dict
+    def uidOf(self, e):
+        start_utc = e['start'].astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        end_utc = e['end'].astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        return eventUID(e['name'], start_utc, end_utc, e.get('rule'))
+    
+    # journal an event for calendar_name and return right away; the flusher writes it
+    # to the server, retrying with backoff while the server is unreachable
+    def queueEvent(self, calendar_name, start, end, name, rule=None):
+        uid = self.uidOf({'name': name, 'start': start, 'end': end, 'rule': rule})
+        self.outbox.add(calendar_name, uid, name, start, end, rule)             # a repeat of a queued event is a no-op
+        self.flusher.wake()
+        return uid
+    
+    # flusher callback: write queued events, grouped by calendar. Events the server
+    # refuses for good are dropped and the user is told. Raises if any are left so the
+    # flusher backs off before trying again
+    def flushOutbox(self):
+        pending = self.outbox.pending()
+        if not pending:
+            return
+        url, user, password = self.getConfigs()
+        if url in (None, 'None', ''):                                           # not configured yet
+            raise WriteError('{} events queued but no server configured'.format(len(pending)))
+        byCalendar = {}
+        for e in pending:
+            byCalendar.setdefault(e['calendar'], []).append(e)
+        failed = 0
+        for calendar_name, events in byCalendar.items():
+            calendarObj = self.calDAVPool.calendar(url, user, password, calendar_name, background=True)
+            for e, (uid, result) in zip(events, self.makeEvents(calendarObj, events)):
+                if isinstance(result, Rejected):
+                    self.log.error('dropping {} for {}: {}'.format(e['name'], calendar_name, result))
+                    self.outbox.done(calendar_name, uid)                        # retrying would only be refused again
+                    self.speak_dialog('event.rejected', {'name': e['name'],
+                                                         'owner': self.calendarToName.get(calendar_name, calendar_name)})
+                elif isinstance(result, Exception):
+                    failed += 1
+                    self.log.error(result)
+                else:
+                    self.outbox.done(calendar_name, uid)                        # 'exists' too: the server already has it
+        if failed:
+            raise WriteError('{} queued events could not be written'.format(failed))
+    
+    # (start, end) of the queued events of calendar_name that overlap [start, end)
+    def pendingIntervals(self, calendar_name, start, end):
+        return [(p['start'].astimezone(default_timezone()), p['end'].astimezone(default_timezone()))
+                for p in self.outbox.pending(calendar_name) if p['start'] < end and p['end'] > start]
+    
+    # add the queued events of calendar_name that fall in [start, end) to events, unless
+    # they already came back from the store
+    def withPending(self, calendar_name, events, start, end):
+        pending = self.outbox.pending(calendar_name)
+        if not pending:
+            return events
+        if start.tzinfo is None:                                                # windows from extract_datetime may be naive
+            start, end = start.replace(tzinfo=default_timezone()), end.replace(tzinfo=default_timezone())
+        seen = {(e['name'], e['start']) for e in events}
+        extra = [{'name': p['name'],
+                  'start': p['start'].astimezone(default_timezone()),
+                  'end': p['end'].astimezone(default_timezone())}
+                 for p in pending if p['start'] < end and p['end'] > start]
+        extra = [e for e in extra if (e['name'], e['start']) not in seen]
+        if not extra:
+            return events
+        return sorted(events + extra, key=lambda e: startKey(e['start'], default_timezone()))
+    
+    # get events in calendar between start and end from the local store. A stale
+    # store still answers right away and is then revalidated in the background: one
+    # depth-0 ctag PROPFIND when nothing changed, a delta sync otherwise
+    def searchEvents(self, calendarObj, start, end):
+        url = str(calendarObj.url)
+        _, synced_at = self.eventStore.syncState(url)
+        if synced_at is None:                                                   # nothing stored yet, so sync before answering
+            try:
+                self.refreshCalendar(calendarObj, wait=True)
+            except Exception as e:
+                self.log.error(e)
+                return self.searchEventsLive(calendarObj, start, end)           # fall back to asking the server directly
+        with self.tracer.span('decode'):                                        # rows to events, expanding recurrences
+            events = self.eventStore.search(url, start, end)
+        if synced_at is not None and time.time() - synced_at > SYNC_MAX_AGE:
+            self.executor.submit(self.refreshCalendar, self.backgroundCalendar(calendarObj)) # only pulls what changed
+        return events
+    
+    # the calendar object of the background session for the same calendar as calendarObj
+    def backgroundCalendar(self, calendarObj):
+        url, user, password = self.getConfigs()
+        calendar_name = str(calendarObj.url).rstrip('/').rsplit('/', 1)[-1]
+        return self.calDAVPool.calendar(url, user, password, calendar_name, background=True)
+    
+    # delta sync one calendar into the store, unless its ctag (asked for, or given when
+    # already known) is unchanged. If another thread is already syncing it, either skip
+    # or (wait=True) wait for that sync and use its result. force=True waits and syncs
+    # regardless, for changes the other sync may have started too early to see
+    def refreshCalendar(self, calendarObj, wait=False, ctag=None, force=False):
+        url = str(calendarObj.url)
+        with self._syncLocksLock:
+            lock = self._syncLocks.setdefault(url, threading.Lock())
+        contended = not lock.acquire(blocking=False)
+        if contended:
+            if not wait and not force:
+                return
+            waited_since = time.time()
+            lock.acquire()
         try:
-            _ = calendarObj.save_event(eventString)                             # send event to Nextcloud calendar
-            self.speak_dialog('event.created',{'owner':owner})
-            
+            if contended and not force:
+                _, synced_at = self.eventStore.syncState(url)
+                if synced_at is not None and synced_at >= waited_since:
+                    return                                                      # the other thread just synced it
+            with self.tracer.span('sync'):
+                syncCalendar(calendarObj, self.eventStore, ctag)
         except Exception as e:
-            self.speak_dialog('caldav.error',{"method":"creating","kind":"event"})
+            if wait:
+                raise
             self.log.error(e)
+        finally:
+            lock.release()
+    
+    # prefetcher callback: sync every known calendar and warm the common windows
+    def prefetchCalendars(self):
+        url, user, password = self.getConfigs()
+        if url in (None, 'None', ''):                                           # not configured yet
+            return
+        self.refreshDirectory(url, user, password)
+        for calendar_name in self.calendarToName:
+            calendarObj = self.calDAVPool.calendar(url, user, password, calendar_name, background=True)
+            self.refreshCalendar(calendarObj, wait=True,
+                                 ctag=self.directory.ctag(calendar_name))       # known from the directory PROPFIND
+            for time_frame in PREFETCH_WINDOWS:                                 # expand recurring events ahead of time
+                start, end = self.convertSpokenTimeRangeToDT(time_frame)
+                self.eventStore.search(str(calendarObj.url), start, end)
+    
+    # revalidate the calendar directory with one PROPFIND of the calendar home (the
+    # principal is only asked where the home is the first time)
+    def refreshDirectory(self, url, user, password):
+        home = self.directory.home
+        if home is None:
+            home = str(self.calDAVPool.principal(url, user, password, background=True).calendar_home_set.url)
+        collections = calendarCollections(self.calDAVPool.client(url, user, password, background=True), home)
+        if self.directory.update(home, collections):
+            self.log.info('calendars: {}'.format(', '.join(self.directory.calendars)))
+            self.applyDirectory()
+    
+    # use the discovered calendars, if there are any yet, for owner lookups
+    def applyDirectory(self):
+        if self.directory.calendars:
+            self.calendarToName = self.directory.possessives()
+            self.nameToCalendar = dict(self.directory.aliases)
     
     # call caldav api for events in calendar between start and end
-    def searchEvents(self, calendarObj, start, end):
+    def searchEventsLive(self, calendarObj, start, end):
         events = []                                                             # initialize list for events
-        _events = calendarObj.date_search(start=start.astimezone(timezone.utc),
-                                          end=end.astimezone(timezone.utc))     # pull events from caldav server, with start and end in utc
+        with self.tracer.span('report'):
+            _events = calendarQuery(calendarObj.client, str(calendarObj.url),
+                                    start.astimezone(timezone.utc),
+                                    end.astimezone(timezone.utc))               # lean REPORT returning only the fields we read
         
-        for e in _events:
-            name = e.vobject_instance.vevent.summary.value.strip()
-            start = e.vobject_instance.vevent.dtstart.value
-            end = e.vobject_instance.vevent.dtend.value
-
-            if type(start) == type(dt.now()):                                   # if start/end are datetimes
-                start = start.astimezone(default_timezone())                    # convert to local TZ
-                end = end.astimezone(default_timezone())
+        with self.tracer.span('decode'):
+            parsed = [e for _, _, data in _events for e in parseEvents(data)]
+        overridden = {(e['uid'], e['recurrence_id']) for e in parsed if e['recurrence_id'] is not None}
+        for e in parsed:
+            if isRecurring(e):                                                  # expand masters into their occurrences
+                skip = {rid for uid, rid in overridden if uid == e['uid']}
+                occurrences = list(iterOccurrences(e, start, end, skip))
+            else:
+                occurrences = [(e['start'], e['end'])]
+            for s, f in occurrences:
+                if type(s) == type(dt.now()):                                   # if start/end are datetimes
+                    s = s.astimezone(default_timezone())                        # convert to local TZ
+                    f = f.astimezone(default_timezone())
                                                                                 # otherwise, they are dates, and can be left
-            event_dict = {'name': name,                                         # build dict with event info
-                          'start': start,
-                          'end': end
-                          }
-            events.append(event_dict)                                           # add dict to list
+                event_dict = {'name': e['summary'],                             # build dict with event info
+                              'start': s,
+                              'end': f
+                              }
+                events.append(event_dict)                                       # add dict to list
         
-        events.reverse()                                                        # events return from caldav server in reverse-chrono order
-        return events                                                           # so reverse the list to allow mycroft to read them off in order    
+        events.sort(key=lambda e: startKey(e['start'], default_timezone()))     # so mycroft reads them off in order
+        return events
     
-    # speak the given list of events
-    def speakEvents(self, events):
-        if len(events) == 0:
-            self.speak_dialog('no.events')
+    # search several calendars concurrently and merge the results in chronological
+    # order; when more than one calendar is searched each event is labelled by owner,
+    # and a calendar that cannot be read while the breaker is open is left out (and
+    # said so) rather than failing the whole answer
+    def searchCalendars(self, calendar_names, start, end, url, user, password):
+        skipped = []
+        @self.onWorker
+        def search(calendar_name):
+            calendarObj = self.getCalendar(calendar_name, url, user, password)
+            if calendarObj is None:
+                return []
+            try:
+                found = self.searchEvents(calendarObj, start, end)
+            except CircuitOpen as e:
+                if len(calendar_names) == 1:
+                    raise
+                self.log.error('leaving out {}: {}'.format(calendar_name, e))
+                skipped.append(calendar_name)
+                found = []
+            events = self.withPending(calendar_name, found, start, end)         # include events still waiting in the outbox
+            if len(calendar_names) > 1:
+                for e in events:
+                    e['owner'] = self.calendarToName.get(calendar_name, calendar_name)
+            return events
+        
+        results = self.loopThread.map(search, calendar_names, self.executor)    # total latency ~ the slowest calendar; stop() cancels
+        if len(results) == 1:
+            return results[0]
+        if len(skipped) == len(calendar_names):
+            raise CircuitOpen('no calendar could be read')
+        if skipped:
+            self.speak_dialog('calendars.skipped', {'owner': ' and '.join(self.calendarToName.get(c, c) for c in skipped)})
+        key = lambda e: startKey(e['start'], default_timezone())
+        return heapq.merge(*results, key=key)                                   # each list is already sorted: lazy k-way merge
+    
+    # wrap fn so it runs on a worker thread with the caller's trace and deadline
+    def onWorker(self, fn):
+        intent, at = self.tracer.current(), currentDeadline()
+        def run(*args):
+            with self.tracer.trace(intent, total=False), deadline(at=at):
+                return fn(*args)
+        return run
+    
+    # when the server is failing: the time the stored copy of calendar_names was last
+    # synced, or None if the server is fine or nothing is stored
+    def staleSince(self, calendar_names, url, user, password):
+        if url in (None, 'None', '') or not self.calDAVPool.breaker(url, user).isOpen:
+            return None
+        synced = [self.eventStore.syncState(str(self.calDAVPool.calendar(url, user, password, name).url))[1]
+                  for name in calendar_names]
+        synced = [t for t in synced if t is not None]
+        return min(synced) if synced else None
+    
+    # e.g. "10:30am", or "tuesday at 10:30am" if it was not today
+    def asOfText(self, timestamp):
+        when = dt.fromtimestamp(timestamp, default_timezone())
+        text = self.timeTextFriendly(when.hour, when.minute)
+        if when.date() != dt.now(default_timezone()).date():
+            text = '{} at {}'.format(self.dayText(when.date()), text)
+        return text
+    
+    # busy (start, end) intervals of calendarObj: from the local store once it has been
+    # synced, otherwise from a free-busy REPORT so no events are downloaded
+    def busyIntervals(self, calendarObj, start, end):
+        url = str(calendarObj.url)
+        _, synced_at = self.eventStore.syncState(url)
+        if synced_at is not None:
+            return [(e['start'], e['end']) for e in self.eventStore.search(url, start, end)
+                    if not isAllDay(e['start'])]                                # all-day events do not block time
+        return [(s.astimezone(default_timezone()), e.astimezone(default_timezone()))  # the REPORT answers in UTC
+                for s, e in freeBusyQuery(calendarObj.client, url, start, end)]
+    
+    # speak the total busy time and the free blocks across the given calendars
+    def speakBusySummary(self, calendar_names, start, end, url, user, password):
+        @self.onWorker
+        def busy(calendar_name):
+            calendarObj = self.getCalendar(calendar_name, url, user, password)
+            stored = self.busyIntervals(calendarObj, start, end) if calendarObj is not None else []
+            return stored + self.pendingIntervals(calendar_name, start, end)    # queued events are busy time too
+        
+        if start.tzinfo is None:                                                # windows from extract_datetime may be naive
+            start, end = start.replace(tzinfo=default_timezone()), end.replace(tzinfo=default_timezone())
+        start = max(start, dt.now(default_timezone()))                          # time that already passed cannot be free
+        intervals = [i for result in self.loopThread.map(busy, calendar_names, self.executor) for i in result]
+        merged = mergeIntervals(clipIntervals(intervals, start, end))           # overlapping events only count once
+        if len(calendar_names) == 1:
+            owner = self.calendarToName.get(calendar_names[0], calendar_names[0])
+        else:
+            owner = 'the family'
+        if not merged:
+            self.speak_dialog('not.busy', {'owner': owner})
             return
-            
+        
+        free = []
+        for day_start, day_end in self.freeHourWindows(start, end):             # free blocks within waking hours, day by day
+            free += freeBlocks(merged, day_start, day_end, MIN_FREE_BLOCK)
+            if len(free) >= 3:
+                break
+        multi_day = start.date() != (end - timedelta(seconds=1)).date()
+        self.speak_dialog('busy.summary', {'owner': owner,
+                                           'count': len(merged),
+                                           'busy': self.durationText(totalDuration(merged)),
+                                           'free': self.freeBlocksText(free[:3], multi_day)})
+    
+    # the FREE_HOURS of each day in [start, end), as (start, end) windows
+    def freeHourWindows(self, start, end):
+        day = start.date()
+        while day <= end.date():
+            midnight = dt.combine(day, dt.min.time(), tzinfo=start.tzinfo)
+            day_start = max(start, midnight + timedelta(hours=FREE_HOURS[0]))
+            day_end = min(end, midnight + timedelta(hours=FREE_HOURS[1]))
+            if day_start < day_end:
+                yield day_start, day_end
+            day += timedelta(1)
+    
+    # e.g. "3 hours and 15 minutes"
+    def durationText(self, duration):
+        minutes = int(duration.total_seconds() // 60)
+        hours, minutes = divmod(minutes, 60)
+        parts = []
+        if hours:
+            parts.append('{} hour{}'.format(hours, '' if hours == 1 else 's'))
+        if minutes or not hours:
+            parts.append('{} minute{}'.format(minutes, '' if minutes == 1 else 's'))
+        return ' and '.join(parts)
+    
+    # e.g. "9:00am to 11:00am and 2:00pm to 8:00pm"
+    def freeBlocksText(self, blocks, multi_day):
+        if not blocks:
+            return 'not free at all'
+        dow = ['monday','tuesday','wednesday','thursday','friday','saturday','sunday']
+        texts = []
+        for s, e in blocks:
+            text = '{} to {}'.format(self.timeTextFriendly(s.hour, s.minute),
+                                     self.timeTextFriendly(e.hour, e.minute))
+            if multi_day:
+                text = '{} {}'.format(dow[s.weekday()], text)
+            texts.append(text)
+        return 'free ' + ' and '.join(texts)
+    
+    # calendars of an owner the grammar does not know ("what is on grandma calendar
+    # today"): the words before "calendar" resolved through the directory, else any
+    # calendar named in the utterance
+    def calendarsOutsideGrammar(self, utt):
+        match = CALENDAR_WORDS_RE.search(utt)
+        if match is not None:
+            words = match.group(1).split()
+            for phrase in (' '.join(words), words[-1]):
+                owned = self.calendarsForPhrase(phrase, fuzzy=True)
+                if owned:
+                    return owned
+        return self.calendarsInUtterance(utt)
+    
+    # every calendar named in a free-form utterance, e.g. "when are madison and i both free"
+    def calendarsInUtterance(self, utt):
+        words = utt.split()
+        names = []
+        i = 0
+        while i < len(words):
+            for n in (2, 1):                                                    # prefer two-word owners like "my lowe"
+                owned = self.calendarsForPhrase(' '.join(words[i:i+n]), fuzzy=n == 2)
+                if owned:
+                    for name in owned:
+                        if name not in names:
+                            names.append(name)
+                    i += n
+                    break
+            else:
+                i += 1
+        return names
+    
+    # calendar names of an owner phrase, or None. With fuzzy, a phrase may also resolve
+    # through the directory ("my lowe" after discovery), but only to a calendar none of
+    # its words names alone, so "madison and" does not swallow the word after "madison"
+    def calendarsForPhrase(self, phrase, fuzzy=False):
+        if phrase in self.householdOwners or phrase in self.nameToCalendar:
+            return self.calendarsForOwner(phrase)
+        if fuzzy and self.directory.calendars:
+            name = self.directory.resolve(phrase)
+            if name is not None and name not in {self.nameToCalendar.get(w) for w in phrase.split()}:
+                return [name]
+        return None
+    
+    # the first phrase in the utterance the time range resolver understands
+    def timeFrameInUtterance(self, utt):
+        words = utt.split()
+        for n in (3, 2, 1):                                                     # longest phrases first ("next friday morning")
+            for i in range(len(words) - n + 1):
+                phrase = ' '.join(words[i:i+n])
+                if self.timeRangeResolver.resolve(phrase) is not None:
+                    return phrase
+        return None
+    
+    # "you" for the personal calendar, the owner's name otherwise
+    def ownerNames(self, calendar_names):
+        names = [self.calendarToName.get(c, c).replace("'s", "").replace('your', 'you') for c in calendar_names]
+        if len(names) == 1:
+            return names[0]
+        return ', '.join(names[:-1]) + ' and ' + names[-1]
+    
+    # calendar names for a spoken owner; raises KeyError for unknown owners
+    def calendarsForOwner(self, owner):
+        if owner in self.householdOwners:
+            return list(self.calendarToName)
+        return [self.calendarForOwner(owner)]
+    
+    # the calendar of a single spoken owner, allowing for misheard names once the
+    # directory is known; raises KeyError for unknown owners
+    def calendarForOwner(self, owner):
+        name = self.nameToCalendar.get(owner)
+        if name is None and self.directory.calendars:
+            name = self.directory.resolve(owner)
+        if name is None:
+            raise KeyError(owner)
+        return name
+    
+    # the parser returns (nested) lists for multi-word matches, e.g. ["this", "weekend"]
+    # or ["next", ["march", ["3", "rd"]]]; join them back into a single phrase
+    def joinParsedTokens(self, value):
+        if type(value) == list:
+            return re.sub(r'(\d) (st|nd|rd|th)\b', r'\1\2',
+                          ' '.join(self.joinParsedTokens(v) for v in value))
+        return value
+    
+    # lazily turn events into spoken lines, so formatting happens as the readout goes
+    def eventLines(self, events):
         for e in events:
             duration_str = self.confirmEventDetails(e['start'], e['end'])       # use the confirmEventDeatils function to get readable string
-            self.speak(e['name'] + ' ' + duration_str)
-            for _ in range(1000):                                               # small delay between events to sound more natural
-                pass
+            if 'owner' in e:                                                    # label events when several calendars were searched
+                yield e['owner'] + ' ' + e['name'] + ' ' + duration_str
+            else:
+                yield e['name'] + ' ' + duration_str
+    
+    # parse utterance for calendar owner and time frame. The compiled fast matcher
+    # handles the common phrasings in one pass; the PEG parser decides the rest
+    def parseUtterance(self, utt):
+        parsed_utt = self.fastMatcher.match(utt)
+        if parsed_utt is None:
+            from tatsu.util import asjson
+            ast = asjson(self.PEGParser.parse(utt))
+            parsed_utt = {key: self.joinParsedTokens(ast[key])
+                          for key in ('calendar_owner', 'time_frame') if ast.get(key) is not None}
+        return parsed_utt
+    
+    # speak the given events one at a time; stop() interrupts the readout, also when
+    # it came while the events were still being fetched
+    def speakEvents(self, events):
+        lines = self.eventLines(events)
+        line = next(lines, None)
+        if line is None:
+            self.speak_dialog('no.events')
+            return
+        
+        self._readingOut = True
+        try:
+            while line is not None and not self._stopSpeaking.is_set():
+                self.speak(line, wait=True)                                     # wait for TTS so the next line is not queued early
+                if self._stopSpeaking.wait(EVENT_PAUSE):                        # small delay between events to sound more natural
+                    return                                                      # returns early if stop() was called
+                line = next(lines, None)
+        finally:
+            self._readingOut = False
+    
+    # read events one by one, or as a per-day digest if there are more than the
+    # threshold. Only threshold+1 events are looked at before deciding
+    def speakEventsOrDigest(self, events, calendar_names, start, end):
+        events = iter(events)
+        head = list(itertools.islice(events, self.digestThreshold() + 1))
+        if len(head) <= self.digestThreshold():
+            self.speakEvents(head)
+            return
+        self.speakDigest(itertools.chain(head, events), calendar_names, start, end)
+    
+    # e.g. "there are 23 events on the family calendar over 5 days", then a line per day
+    def speakDigest(self, events, calendar_names, start, end):
+        self._readingOut = True
+        try:
+            if self._stopSpeaking.is_set():
+                return
+            days = digestEvents(events, default_timezone(), top=DIGEST_ITEMS)
+            if len(calendar_names) == 1:
+                owner = self.calendarToName.get(calendar_names[0], calendar_names[0])
+            else:
+                owner = 'the family'
+            self.speak_dialog('digest.summary', {'owner': owner,
+                                                 'count': sum(d.count for d in days),
+                                                 'days': len(days)}, wait=True)
+            long_window = end - start > timedelta(7)                            # weekday names alone are ambiguous
+            for d in days:
+                if self._stopSpeaking.wait(EVENT_PAUSE):
+                    return
+                self.speak_dialog('digest.day', {'day': self.dayText(d.day, long_window),
+                                                 'events': self.countText(d.count, 'event'),
+                                                 'times': self.digestTimesText(d),
+                                                 'items': ' and '.join(d.items())}, wait=True)
+            self._lastDigest = (calendar_names, start, end)
+            self.set_context('DigestContext')                                   # enables the drill-down intent
+            self.speak_dialog('digest.more')
+        finally:
+            self._readingOut = False
+    
+    # e.g. "from 9:00am to 5:30pm", "all day" or "all day and from 9:00am to 10:00am"
+    def digestTimesText(self, day):
+        parts = []
+        if day.all_day:
+            parts.append('all day')
+        if day.first is not None:
+            first = day.first.astimezone(default_timezone())
+            last = day.last.astimezone(default_timezone())
+            parts.append('from {} to {}'.format(self.timeTextFriendly(first.hour, first.minute),
+                                                self.timeTextFriendly(last.hour, last.minute)))
+        return ' and '.join(parts)
+    
+    # e.g. "1 event", "3 events"
+    def countText(self, count, noun):
+        return '{} {}{}'.format(count, noun, '' if count == 1 else 's')
+    
+    # e.g. "tuesday", or "tuesday october 20th" when the week alone is not enough
+    def dayText(self, day, with_date=False):
+        dow = ['monday','tuesday','wednesday','thursday','friday','saturday','sunday']
+        if not with_date:
+            return dow[day.weekday()]
+        return self.confirmEventDetails(day, day + timedelta(1))[3:]            # drop the leading "on "
+    
+    # the date in the last digest's window that utt refers to, e.g. "tell me more about tuesday"
+    def digestDay(self, utt, start, end):
+        first, last = start.date(), (end - timedelta(seconds=1)).date()
+        dow = ['monday','tuesday','wednesday','thursday','friday','saturday','sunday']
+        for word in utt.split():
+            if word in dow:                                                     # the matching weekday inside the window
+                day = first + timedelta((dow.index(word) - first.weekday()) % 7)
+                return day if day <= last else None
+        time_frame = self.timeFrameInUtterance(utt)
+        if time_frame is None:
+            return None
+        day = self.timeRangeResolver.resolve(time_frame)[0].date()
+        return day if first <= day <= last else None
     
     # returns the caldav calendar object for the calendar_name in the given nextcloud account
     def getCalendar(self, calendar_name, url, user, password):
         try:
-            URL = 'https://{}/remote.php/dav/calendars/{}'.format(url,user)     # build base URL
-            calURL = '{}/{}'.format(URL,calendar_name)                          # add calendar name to URL to get URL to calendar
-            self.log.info('calendar url: {}'.format(calURL))
-            client = caldav.DAVClient(url=URL, username=user, password=password) # construct the client
-            calendar = caldav.Calendar(client=client, url=calURL)               # constuct the calendar object
+            calendar = self.calDAVPool.calendar(url, user, password, calendar_name) # reuse the pooled client and calendar object
+            self.log.info('calendar url: {}'.format(calendar.url))
             return calendar
         
         except Exception as e:
@@ -218,11 +822,13 @@ END:VCALENDAR
     # return list of all calendars available from nextcloud account
     def getAllCalendars(self, url, user, password):
         try:
-            URL = 'https://{}/remote.php/dav/calendars/{}'.format(url,user)     # build base URL
-            principal = caldav.DAVClient(url=URL, username=user, password=password).principal() # construct principal
+            principal = self.calDAVPool.principal(url, user, password)          # reuse the pooled principal
             calendars = principal.calendars()                                   # get list of calendars
             for c in calendars:
                 self.log.info('got calendar {}'.format(c.name))                 # log the calendar names (this might not actually work)
+            self.directory.update(str(principal.calendar_home_set.url),
+                                  [(str(c.url), c.name, None) for c in calendars])
+            self.applyDirectory()
             return calendars
         
         except Exception as e:
@@ -293,13 +899,16 @@ END:VCALENDAR
         
     @intent_handler(IntentBuilder("AddEvent").require("Add").require("Event").
                     require("Calendar").optionally("Whose.Calendar"))
+    @traced('add')
     def handle_add_event_intent(self,message):
         utt = message.data['utterance']
-        time_delta,remaining_utt = extract_duration(utt)                        # get time duration from utterance
-        start_time,remaining_utt = extract_datetime(remaining_utt)              # get time from utterance
+        with self.tracer.span('resolve'):
+            time_delta,remaining_utt = extract_duration(utt)                    # get time duration from utterance
+            start_time,remaining_utt = extract_datetime(remaining_utt)          # get time from utterance
         owner = message.data.get('Owner')                                       # get calendar owner
-        utt = normalize(utt).replace("'s","")                                   # normalize and drop 's in utterance
-        parsed_utt = asjson(self.PEGParser.parse(utt))                                # parse utterance for owner
+        utt = normalize(utt, remove_articles=False).replace("'s","")                                   # normalize and drop 's in utterance
+        with self.tracer.span('parse'):
+            parsed_utt = self.parseUtterance(utt)                               # parse utterance for owner
         owner = parsed_utt.get('calendar_owner')
         if owner is None:                                                       # if parser failed to get owner, prompt user
             owner = self.get_response('ask.calendar.owner')
@@ -307,7 +916,7 @@ END:VCALENDAR
         self.log.info('using owner: {}'.format(owner))
         
         try:                                                                    # get the calendar belonging to owner
-            calName = self.nameToCalendar[owner]                                # throw error if none found
+            calName = self.calendarForOwner(owner)                              # throw error if none found
         except KeyError:
             self.speak_dialog('no.calendar.found.error',{'name':owner})
             return
@@ -335,48 +944,229 @@ END:VCALENDAR
             self.speak_dialog('confirmation.failed')
 
         elif confirmation == 'yes':        
-            url, user, password = self.getConfigs()                             # get  configs
-            if url is None:                                                     # if getConfigs returned None, it failed and
-                pass                                                            # already spoke to user
-            else:               
-                calendar = self.getCalendar(calName, url, user, password)       # get calendar and create the event
-                self.makeEvent(calendar, start_time, end_time, eventName, owner=self.calendarToName[calName])
+            with self.tracer.span('queue'):
+                self.queueEvent(calName, start_time, end_time, eventName)       # journaled now, sent to the server in the background
+            with self.tracer.span('speak'):
+                self.speak_dialog('event.created',{'owner':self.calendarToName[calName]}, wait=True)
         else:
             self.speak('sorry i did not understand.')
 
-    @intent_handler(IntentBuilder("ListEvents").require("List").one_of("Calendar","Time"))
+    @intent_handler(IntentBuilder("FindFreeTime").require("Free").one_of("Time","Calendar","Slot"))
+    @cancellable
+    @withDeadline(INTENT_DEADLINE)
+    def handle_find_free_time_intent(self, message):
+        utt = normalize(message.data['utterance'], remove_articles=False).replace("'s","")
+        calendar_names = self.calendarsInUtterance(utt) or ['personal']        # default to the personal calendar
+        time_frame = self.timeFrameInUtterance(utt) or 'today'
+        duration, _ = extract_duration(utt)
+        duration = duration or DEFAULT_SLOT
+        
+        start, end = self.convertSpokenTimeRangeToDT(time_frame)
+        start = max(start, dt.now(default_timezone()))                          # only look for slots from now on
+        url, user, password = self.getConfigs()
+        @self.onWorker
+        def busy(calendar_name):                                                # fetch every calendar concurrently
+            calendarObj = self.getCalendar(calendar_name, url, user, password)
+            stored = self.busyIntervals(calendarObj, start, end) if calendarObj is not None else []
+            return stored + self.pendingIntervals(calendar_name, start, end)    # queued events are busy time too
+        try:
+            busy_lists = self.loopThread.map(busy, calendar_names, self.executor)
+        except Unavailable as e:
+            self.log.error(e)
+            self.speak_dialog('server.unavailable')
+            return
+        
+        slots = []
+        for day_start, day_end in self.freeHourWindows(start, end):             # nobody wants a slot at 3am
+            slots += findFreeSlots(busy_lists, day_start, day_end, duration,    # sweep-line over all the busy intervals
+                                   limit=3 - len(slots))
+            if len(slots) >= 3:
+                break
+        owners = self.ownerNames(calendar_names)
+        verb = 'are' if len(calendar_names) > 1 or owners == 'you' else 'is'
+        if not slots:
+            self.speak_dialog('no.free.slots', {'owners': owners, 'verb': verb,
+                                                'duration': self.durationText(duration)})
+            return
+        multi_day = start.date() != (end - timedelta(seconds=1)).date()
+        self.speak_dialog('free.slots', {'owners': owners, 'verb': verb,
+                                         'slots': self.freeBlocksText(slots, multi_day)})
+
+    @intent_handler(IntentBuilder("ListEvents").require("List").one_of("Calendar","Time").exclude("More"))
+    @traced('list')
+    @cancellable
+    @withDeadline(INTENT_DEADLINE)
     def handle_list_events_intent(self, message):
+        self._stopSpeaking.clear()                                              # a stop() from now on ends this readout
         utt = message.data['utterance']
-        utt = normalize(utt).replace("'s","")                                   # normalize and drop "****'s"
+        utt = normalize(utt, remove_articles=False).replace("'s","")            # normalize and drop "****'s"
         try:
-            ast = self.PEGParser.parse(utt)                                     # parse utterance for owner and time frame
-            parsed_utt = asjson(ast)
+            with self.tracer.span('parse'):
+                parsed_utt = self.parseUtterance(utt)                           # parse utterance for owner and time frame
             
             calendar_owner = parsed_utt.get('calendar_owner')                   # use .get() to return None if key not found
             calendar_timeframe = parsed_utt.get('time_frame')                   # rather than error-ing out on a failed ['<key>']    
-        except Exception as e:
+        except Exception as e:                                                  # e.g. an owner only known from discovery
+            self.log.info('grammar did not match, resolving through the directory: {}'.format(e))
+            calendar_owner, calendar_timeframe = None, self.timeFrameInUtterance(utt)
+        
+        if calendar_owner is not None:
+            try:                                                                # get the calendar(s) belonging to owner
+                calendar_names = self.calendarsForOwner(calendar_owner)
+            except KeyError:
+                self.speak_dialog('no.calendar.found.error',{'name':calendar_owner})
+                return
+        else:
+            calendar_names = self.calendarsOutsideGrammar(utt)
+        if not calendar_names or calendar_timeframe is None:
             self.speak('there was an error parsing your utternace')
-            self.log.error(e)
             return
         
-        if calendar_owner == None:                                              # if owner not found, default to personal calendar
-            calendar_owner = 'my'
-        
-        # parser will return list if timeframe is two words (e.g. ["this", "weekend"]) and convertSpokenTimeRangeToDT
-        # takes a string as input, so join with space if calendar_timeframe is a list
-        if type(calendar_timeframe) == list:
-            calendar_timeframe = ' '.join(calendar_timeframe)
-        
-        start,end = self.convertSpokenTimeRangeToDT(calendar_timeframe)         # generate the start and end times for the event search
+        with self.tracer.span('resolve'):
+            start,end = self.convertSpokenTimeRangeToDT(calendar_timeframe)     # generate the start and end times for the event search
         
         url, user, password = self.getConfigs()                                 # get config settings
-        calendarObj = self.getCalendar(self.nameToCalendar[calendar_owner],     # construct caldav calendar object
-                                       url, user, password)
-        events = self.searchEvents(calendarObj, start, end)                     # get list of events between start and end
-        self.speakEvents(events)                                                # speak those events
+        stale_since = self.staleSince(calendar_names, url, user, password)
+        if stale_since is not None:                                             # answer from the store, but say how old it is
+            self.speak_dialog('stale.data', {'time': self.asOfText(stale_since)})
+        try:
+            if utt.startswith('how busy'):                                      # summarise busy time instead of listing events
+                self.speakBusySummary(calendar_names, start, end, url, user, password)
+                return
+            with self.tracer.span('fetch'):
+                events = self.searchCalendars(calendar_names, start, end,       # get list of events between start and end
+                                              url, user, password)
+        except Unavailable as e:                                                # nothing stored and the server is down or slow
+            self.log.error(e)
+            self.speak_dialog('server.unavailable')
+            return
+        with self.tracer.span('speak'):
+            self.speakEventsOrDigest(events, calendar_names, start, end)        # speak those events, or a digest of them
+
+    @intent_handler(IntentBuilder("DigestDay").require("More").require("DigestContext"))
+    @cancellable
+    @withDeadline(INTENT_DEADLINE)
+    def handle_digest_day_intent(self, message):
+        self._stopSpeaking.clear()                                              # a stop() from now on ends this readout
+        calendar_names, start, end = self._lastDigest
+        if start.tzinfo is None:                                                # windows from extract_datetime may be naive
+            start, end = start.replace(tzinfo=default_timezone()), end.replace(tzinfo=default_timezone())
+        utt = normalize(message.data['utterance'], remove_articles=False)
+        day = self.digestDay(utt, start, end)
+        if day is None:
+            self.speak_dialog('digest.day.unknown')
+            return
+        
+        day_start = max(start, dt.combine(day, dt.min.time(), tzinfo=start.tzinfo))
+        day_end = min(end, dt.combine(day + timedelta(1), dt.min.time(), tzinfo=start.tzinfo))
+        url, user, password = self.getConfigs()
+        try:
+            events = self.searchCalendars(calendar_names, day_start, day_end, url, user, password)
+        except Unavailable as e:
+            self.log.error(e)
+            self.speak_dialog('server.unavailable')
+            return
+        self.speakEvents(events)                                                # the whole day, however long
 
+    # bus request for the latency histograms; replies with a per intent/stage summary
+    def handle_latency_request(self, message):
+        self.bus.emit(message.response({'latency': self.tracer.summary()}))
+
+    # bus request {'path', 'calendar'}: upload every event of an .ics file to the calendar
+    # of an owner ("my", "madison", ...). Runs in its own thread and sends its PUTs on
+    # self.bulkExecutor, leaving self.executor to the intents
+    def handle_import_request(self, message):
+        threading.Thread(target=self.bulkTransfer, args=(message, 'import', self.importFile),
+                         name='calendar-import', daemon=True).start()
+
+    # bus request {'path', 'calendar', 'start', 'end'}: write the calendar's events between
+    # two ISO dates (default: the coming year) to a new .ics file in the skill's exports
+    # directory; the response carries the full path
+    def handle_export_request(self, message):
+        threading.Thread(target=self.bulkTransfer, args=(message, 'export', self.exportFile),
+                         name='calendar-export', daemon=True).start()
+
+    # run an import or export, emitting skill.nextcloud-calendar.<kind>.progress after every
+    # batch and the final totals (or the error) as the response
+    def bulkTransfer(self, message, kind, transfer):
+        progress = lambda summary: self.bus.emit(message.forward(
+            'skill.nextcloud-calendar.{}.progress'.format(kind), summary))
+        try:
+            url, user, password = self.getConfigs()
+            calendar_name = self.calendarForOwner(message.data.get('calendar') or 'my')
+            calendarObj = self.calDAVPool.calendar(url, user, password, calendar_name, background=True)
+            summary = transfer(calendarObj, message.data, progress)
+        except Exception as e:
+            self.log.error(e)
+            self.bus.emit(message.response({'error': str(e)}))
+            return
+        self.log.info('{} of {}: {} events in {:.1f} s ({:.1f} per s)'.format(
+                      kind, calendar_name, summary['events'], summary['seconds'], summary['events_per_second']))
+        self.bus.emit(message.response(summary))
+
+    def importFile(self, calendarObj, data, progress):
+        with open(data['path'], 'r', encoding='utf-8', errors='replace', newline='') as fObj:
+            summary = importEvents(calendarObj.client, str(calendarObj.url), fObj, self.bulkExecutor,
+                                   progress=progress)
+        self.refreshCalendar(calendarObj, force=True)                           # pick the new events up in the local store; a
+        return summary                                                          # failure is only logged, the import succeeded
+
+    def exportFile(self, calendarObj, data, progress):
+        start = dt.fromisoformat(data['start']) if data.get('start') else dt.now(default_timezone())
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=default_timezone())
+        end = dt.fromisoformat(data['end']) if data.get('end') else start + timedelta(days=365)
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=default_timezone())
+        path = self.exportPath(data['path'])
+        tmp = path + '.tmp'                                                     # a failed export leaves no half-written file
+        with open(tmp, 'x', encoding='utf-8', newline='') as fObj:              # 'x': not even a concurrent export's
+            try:
+                summary = exportEvents(calendarObj.client, str(calendarObj.url), start, end, fObj,
+                                       progress=progress)
+            except Exception:
+                os.remove(tmp)
+                raise
+        os.replace(tmp, path)
+        summary['path'] = path
+        return summary
+    
+    # where an export named `name` is written: inside the exports directory of the skill's
+    # data dir, never over an existing file, since the name comes from the message bus
+    def exportPath(self, name):
+        directory = os.path.join(self.file_system.path, 'exports')
+        path = os.path.realpath(os.path.join(directory, name))
+        if os.path.dirname(path) != os.path.realpath(directory):
+            raise ValueError('exports are written to {}, not {}'.format(directory, name))
+        if os.path.exists(path):
+            raise FileExistsError('{} already exists'.format(path))
+        os.makedirs(directory, exist_ok=True)
+        return path
+
+    # interrupt a readout and cancel the server queries of every handler in flight;
+    # True if either was going on
     def stop(self):
-        pass
+        speaking = self._readingOut
+        self._stopSpeaking.set()
+        cancelled = self.loopThread is not None and self.loopThread.cancelAll()
+        return bool(speaking or cancelled)
+    
+    # stop the background threads and wait for them, so nothing is still syncing when the
+    # store and the outbox are closed
+    def shutdown(self):
+        self.prefetcher.stop()
+        self.flusher.stop()
+        self.loopThread.stop()
+        for thread in (self.prefetcher, self.flusher, self.loopThread):
+            thread.join(SHUTDOWN_TIMEOUT)
+        try:
+            self.executor.shutdown(wait=True, cancel_futures=True)              # queued refreshes are not worth waiting for
+        except TypeError:                                                       # python < 3.9
+            self.executor.shutdown(wait=True)
+        self.bulkExecutor.shutdown(wait=False)                                  # an import in flight stops at its next batch
+        self.calDAVPool.clear()
+        self.eventStore.close()
+        self.outbox.close()
     
 def create_skill():
     return NextcloudCalendarSkill()
\ No newline at end of file
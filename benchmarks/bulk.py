@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Import a multi-year school and sports schedule into the CalDAV stand-in with
+# ncal.bulk, export it back out, and report the throughput of both. With --memory
+# the peak Python memory of each is traced too, which slows them down about 2x.
+#
+#   python benchmarks/bulk.py [--events 20000] [--latency-ms 5] [--batch 50] [--workers 8] [--memory]
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime as dt
+from datetime import timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+from caldavserver import CalDAVStandIn
+from dateutil import tz
+from ncal import CalDAVPool, exportEvents, importEvents, iterComponents
+
+TZ = tz.gettz('America/Chicago')
+TITLES = ['Soccer practice', 'Swim meet', 'Early release', 'No school', 'Band concert',
+          'Parent teacher conference', 'Basketball game', 'Field trip', 'Picture day']
+VTIMEZONE = '''BEGIN:VTIMEZONE
+TZID:America/Chicago
+BEGIN:DAYLIGHT
+TZOFFSETFROM:-0600
+TZOFFSETTO:-0500
+TZNAME:CDT
+DTSTART:19700308T020000
+RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=2SU
+END:DAYLIGHT
+BEGIN:STANDARD
+TZOFFSETFROM:-0500
+TZOFFSETTO:-0600
+TZNAME:CST
+DTSTART:19701101T020000
+RRULE:FREQ=YEARLY;BYMONTH=11;BYDAY=1SU
+END:STANDARD
+END:VTIMEZONE
+'''
+
+
+# write a schedule of n events over `years` years, the way school and league sites export them
+def writeSchedule(path, n, years, first, seed=0):
+    rand = random.Random(seed)
+    with open(path, 'w', newline='') as fObj:
+        fObj.write('BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//School District//Calendar//EN\r\n')
+        fObj.write(VTIMEZONE.replace('\n', '\r\n'))
+        for i in range(n):
+            start = first + timedelta(days=rand.randrange(years * 365), hours=rand.randrange(7, 19))
+            lines = ['BEGIN:VEVENT', 'UID:schedule-{}@district.example'.format(i),
+                     'DTSTAMP:20210101T000000Z']
+            if rand.random() < 0.2:
+                lines += ['DTSTART;VALUE=DATE:' + start.strftime('%Y%m%d')]
+            else:
+                lines += ['DTSTART;TZID=America/Chicago:' + start.strftime('%Y%m%dT%H%M%S'),
+                          'DURATION:PT{}M'.format(rand.choice((45, 60, 90, 120)))]
+            lines += ['SUMMARY:{} {}'.format(rand.choice(TITLES), i % 12),
+                      'DESCRIPTION:Meet at the north entrance. Bring water\\, a snack and the sig',
+                      ' ned permission slip.',
+                      'BEGIN:VALARM', 'ACTION:DISPLAY', 'TRIGGER:-PT30M', 'END:VALARM', 'END:VEVENT']
+            fObj.write('\r\n'.join(lines) + '\r\n')
+        fObj.write('END:VCALENDAR\r\n')
+
+
+# run transfer, returning its summary with the traced peak memory (or None)
+def measure(transfer, memory):
+    if not memory:
+        return transfer(), None
+    tracemalloc.start()
+    try:
+        return transfer(), tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def peakText(peak):
+    return ', peak {:.1f} MB'.format(peak / 1e6) if peak is not None else ''
+
+
+def main():
+    args = argparse.ArgumentParser(description='bulk .ics import and export against the CalDAV stand-in')
+    args.add_argument('--events', type=int, default=20000, help='events in the schedule')
+    args.add_argument('--years', type=int, default=4, help='years the schedule covers')
+    args.add_argument('--latency-ms', type=float, default=5.0, help='delay added to every request')
+    args.add_argument('--batch', type=int, default=50, help='objects per import batch')
+    args.add_argument('--workers', type=int, default=8, help='concurrent PUTs')
+    args.add_argument('--memory', action='store_true', help='also report peak memory')
+    args = args.parse_args()
+
+    standin = CalDAVStandIn(calendars={'school': 'School'}, events=0,
+                            latency=args.latency_ms / 1000.0).start()
+    work_dir = tempfile.mkdtemp(prefix='ncal-bulk-')
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    pool = CalDAVPool(max_connections=args.workers)
+    try:
+        first = dt(2021, 8, 16, tzinfo=TZ)
+        source = os.path.join(work_dir, 'schedule.ics')
+        writeSchedule(source, args.events, args.years, first)
+        calendarObj = pool.calendar(standin.url, standin.user, 'bench', 'school')
+        print('{} events over {} years ({:.1f} MB), {:.0f} ms per request, {} concurrent PUTs'.format(
+              args.events, args.years, os.path.getsize(source) / 1e6, args.latency_ms, args.workers))
+
+        def upload():
+            with open(source, newline='') as fObj:
+                return importEvents(calendarObj.client, str(calendarObj.url), fObj, executor, batch=args.batch)
+        summary, peak = measure(upload, args.memory)
+        print('import: {events} events in {seconds:.2f} s ({events_per_second:.0f} per s), '
+              '{created} created, {exists} existing, {failed} failed'.format(**summary) + peakText(peak))
+
+        again = upload()
+        print('re-import: {events} events in {seconds:.2f} s, {created} created, {exists} existing'.format(**again))
+
+        target = os.path.join(work_dir, 'export.ics')
+        def download():
+            with open(target, 'w', newline='') as fObj:
+                return exportEvents(calendarObj.client, str(calendarObj.url), first,
+                                    first + timedelta(days=args.years * 365 + 1), fObj)
+        summary, peak = measure(download, args.memory)
+        print('export: {events} events in {seconds:.2f} s ({events_per_second:.0f} per s), '
+              '{:.1f} MB written'.format(summary['bytes'] / 1e6, **summary) + peakText(peak))
+        with open(target, newline='') as fObj:
+            exported = sum(1 for name, _ in iterComponents(fObj) if name == 'VEVENT')
+        assert exported == args.events, 'exported {} of {} events'.format(exported, args.events)
+    finally:
+        executor.shutdown()
+        pool.clear()
+        standin.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,458 @@
+# -*- coding: utf-8 -*-
+# In-process stand-in for a Nextcloud CalDAV server, so the skill's I/O paths can
+# be exercised and benchmarked without a live Nextcloud.
+#
+# Serves /remote.php/dav/calendars/<user>/<calendar>/ with synthetic calendars of
+# a configurable size and recurrence density, and delays every request by a fixed
+# latency. Speaks the subset of WebDAV/CalDAV the skill and caldav use: PROPFIND
+# (principal discovery, calendar listing, getctag, sync-token), REPORT
+# (sync-collection, calendar-multiget, calendar-query, free-busy-query), and GET,
+# PUT (with If-None-Match / If-Match) and DELETE of calendar objects.
+#
+#   python benchmarks/caldavserver.py [--port 8008] [--events 500] [--recurring 0.1] [--latency-ms 20]
+#
+# then set the skill's server_url to http://127.0.0.1:8008 (any user and password).
+import argparse
+import hashlib
+import os
+import random
+import re
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.etree import ElementTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ncal.ical import parseDateValue, parseEvents
+from ncal.recurrence import isRecurring, iterOccurrences
+
+DAV = '{DAV:}'
+CALDAV = '{urn:ietf:params:xml:ns:caldav}'
+CS = '{http://calendarserver.org/ns/}'
+SYNC_PREFIX = 'http://sabre.io/ns/sync/'
+
+ElementTree.register_namespace('d', 'DAV:')
+ElementTree.register_namespace('cal', 'urn:ietf:params:xml:ns:caldav')
+ElementTree.register_namespace('cs', 'http://calendarserver.org/ns/')
+
+CALENDARS = {'personal': 'Personal', 'madison-1': 'Madison', 'milo': 'Milo'}
+SUMMARIES = ['Soccer Practice', 'Dentist', 'Team Meeting', 'Piano Lesson', 'Lunch With Sam',
+             'Book Club', 'Gym', 'Parent Teacher Conference', 'Grocery Run', 'Standup']
+RULES = ['FREQ=WEEKLY;COUNT=20', 'FREQ=DAILY;INTERVAL=2;COUNT=30', 'FREQ=WEEKLY;BYDAY=MO,WE,FR',
+         'FREQ=MONTHLY;COUNT=12']
+
+EVENT = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//Sabre//Sabre VObject 4.3.0//EN
+BEGIN:VEVENT
+UID:{uid}
+DTSTAMP:20210101T000000Z
+{start}
+{end}
+SUMMARY:{summary}
+DESCRIPTION:Synthetic event {uid} from the CalDAV stand-in
+{rrule}END:VEVENT
+END:VCALENDAR
+"""
+
+
+def utc(value):
+    return value.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+# one synthetic calendar object; recurring with probability `recurring`
+def syntheticEvent(rand, uid, first_day, days, recurring):
+    day = first_day + timedelta(rand.randrange(days))
+    if rand.random() < 0.05:                                                    # a few all-day events
+        start = 'DTSTART;VALUE=DATE:{:%Y%m%d}'.format(day)
+        end = 'DTEND;VALUE=DATE:{:%Y%m%d}'.format(day + timedelta(1))
+    else:
+        begin = datetime(day.year, day.month, day.day, tzinfo=timezone.utc) + \
+            timedelta(minutes=rand.randrange(7 * 4, 21 * 4) * 15)
+        start = 'DTSTART:' + utc(begin)
+        end = 'DTEND:' + utc(begin + timedelta(minutes=rand.choice([30, 45, 60, 90, 120, 180])))
+    rrule = 'RRULE:{}\n'.format(rand.choice(RULES)) if rand.random() < recurring else ''
+    return EVENT.format(uid=uid, start=start, end=end, summary=rand.choice(SUMMARIES), rrule=rrule)
+
+
+class Calendar(object):
+    """Objects of one calendar plus the change log sync-collection answers from."""
+    def __init__(self, name, displayname):
+        self.name = name
+        self.displayname = displayname
+        self.objects = {}                                                       # object name -> (etag, data, events)
+        self.changes = []                                                       # (token, object name) in token order
+        self.token = 1
+
+    @property
+    def ctag(self):
+        return '"{}"'.format(self.token)
+
+    def put(self, name, data):
+        etag = '"{}"'.format(hashlib.sha1(data.encode('utf-8')).hexdigest()[:16])
+        try:
+            events = list(parseEvents(data))
+        except Exception:                                                       # stored anyway, like a real server would
+            events = []
+        self.objects[name] = (etag, data, events)
+        self._changed(name)
+        return etag
+
+    def delete(self, name):
+        del self.objects[name]
+        self._changed(name)
+
+    def _changed(self, name):
+        self.token += 1
+        self.changes.append((self.token, name))
+
+    # names changed since token, or None if the token is not one we issued
+    def changedSince(self, token):
+        if not token:
+            return set(self.objects)
+        if not token.startswith(SYNC_PREFIX) or not token[len(SYNC_PREFIX):].isdigit():
+            return None
+        since = int(token[len(SYNC_PREFIX):])
+        if since > self.token:
+            return None
+        return {name for t, name in self.changes if t > since}
+
+    # (start, end) occurrences of the object overlapping [start, end)
+    def occurrences(self, name, start, end):
+        for e in self.objects[name][2]:
+            if isRecurring(e):
+                for s, f in iterOccurrences(e, start, end, set()):
+                    yield s, f
+            else:
+                s, f = e['start'], e['end'] or e['start']
+                if not isinstance(s, datetime):                                 # all-day: midnight UTC is close enough here
+                    s = datetime(s.year, s.month, s.day, tzinfo=timezone.utc)
+                    f = datetime(f.year, f.month, f.day, tzinfo=timezone.utc)
+                if s < end and f > start:
+                    yield s, f
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # clients that gave up (timeouts, cancelled queries) are expected here
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            ThreadingHTTPServer.handle_error(self, request, client_address)
+
+
+class CalDAVStandIn(object):
+    """A threaded CalDAV server on 127.0.0.1 holding synthetic calendars.
+
+    `events` objects are generated per calendar over `days` days starting a week
+    ago; a `recurring` fraction of them carry an RRULE. Every request sleeps
+    `latency` seconds first, to stand in for the network and server time.
+    """
+    def __init__(self, user='bench', calendars=CALENDARS, events=500, recurring=0.1,
+                 latency=0.0, days=60, seed=0, port=0):
+        self.user = user
+        self.latency = latency
+        self.requests = {}                                                      # method -> count
+        self.lock = threading.Lock()
+        self.calendars = {}
+        rand = random.Random(seed)
+        first_day = date.today() - timedelta(7)
+        for name, displayname in calendars.items():
+            calendar = self.calendars[name] = Calendar(name, displayname)
+            for i in range(events):
+                uid = '{}-{}'.format(name, i)
+                calendar.put(uid + '.ics', syntheticEvent(rand, uid, first_day, days, recurring))
+        self.httpd = Server(('127.0.0.1', port), Handler)
+        self.httpd.standin = self
+        self._thread = None
+
+    # server_url setting for the skill
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.httpd.server_address[1])
+
+    @property
+    def home(self):
+        return '/remote.php/dav/calendars/{}/'.format(self.user)
+
+    @property
+    def principal(self):
+        return '/remote.php/dav/principals/users/{}/'.format(self.user)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='caldav-standin', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, method):
+        with self.lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+
+def element(tag, text=None, children=()):
+    e = ElementTree.Element(tag)
+    e.text = text
+    e.extend(children)
+    return e
+
+
+def href(path):
+    return element(DAV + 'href', path)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'                                               # keep-alive, as the pooled session expects
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def standin(self):
+        return self.server.standin
+
+    # (is under the calendar home, calendar, object name) for the request path. The
+    # calendar is None for the home itself or an unknown calendar, name None for a calendar
+    def resolve(self):
+        path = self.path.split('?', 1)[0]
+        match = re.match(r'^/remote\.php/dav/calendars/([^/]+)/?([^/]*)/?([^/]*)$', path)
+        if match is None or match.group(1) != self.standin.user:
+            return False, None, None
+        if not match.group(2):
+            return True, None, None
+        return True, self.standin.calendars.get(match.group(2)), match.group(3) or None
+
+    def body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length).decode('utf-8') if length else ''
+
+    def reply(self, status, body=b'', content_type='application/xml; charset=utf-8', headers=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def multistatus(self, responses, sync_token=None):
+        root = element(DAV + 'multistatus', children=responses)
+        if sync_token is not None:
+            root.append(element(DAV + 'sync-token', sync_token))
+        self.reply(207, ElementTree.tostring(root, encoding='utf-8', xml_declaration=True))
+
+    def begin(self):
+        self.standin.count(self.command)
+        if self.standin.latency:
+            time.sleep(self.standin.latency)
+
+    # ---- PROPFIND ----
+
+    # {tag: element} of every property the resource at path has
+    def properties(self, path, calendar=None, name=None):
+        standin = self.standin
+        props = {DAV + 'current-user-principal': [href(standin.principal)],
+                 CALDAV + 'calendar-home-set': [href(standin.home)]}
+        if calendar is None:
+            props[DAV + 'resourcetype'] = [element(DAV + 'collection')]
+            props[DAV + 'displayname'] = standin.user
+        elif name is None:
+            props[DAV + 'resourcetype'] = [element(DAV + 'collection'), element(CALDAV + 'calendar')]
+            props[DAV + 'displayname'] = calendar.displayname
+            props[CS + 'getctag'] = calendar.ctag
+            props[DAV + 'sync-token'] = SYNC_PREFIX + str(calendar.token)
+            props[CALDAV + 'supported-calendar-component-set'] = [element(CALDAV + 'comp')]
+        else:
+            props[DAV + 'resourcetype'] = []
+            props[DAV + 'getetag'] = calendar.objects[name][0]
+            props[DAV + 'getcontenttype'] = 'text/calendar; charset=utf-8; component=vevent'
+        return props
+
+    def propResponse(self, path, props, wanted):
+        found, missing = [], []
+        for tag in wanted if wanted is not None else props:
+            if tag not in props:
+                missing.append(element(tag))
+                continue
+            value = props[tag]
+            if isinstance(value, list):
+                found.append(element(tag, children=value))
+            else:
+                found.append(element(tag, value))
+        propstats = [element(DAV + 'propstat', children=[element(DAV + 'prop', children=found),
+                                                          element(DAV + 'status', 'HTTP/1.1 200 OK')])]
+        if missing:
+            propstats.append(element(DAV + 'propstat', children=[
+                element(DAV + 'prop', children=missing),
+                element(DAV + 'status', 'HTTP/1.1 404 Not Found')]))
+        return element(DAV + 'response', children=[href(path)] + propstats)
+
+    def do_PROPFIND(self):
+        self.begin()
+        body = self.body()
+        wanted = None                                                           # allprop
+        if body.strip():
+            prop = ElementTree.fromstring(body).find(DAV + 'prop')
+            if prop is not None:
+                wanted = [child.tag for child in prop]
+        depth = self.headers.get('Depth', '0')
+        path = self.path.split('?', 1)[0]
+        if path.rstrip('/') == self.standin.principal.rstrip('/'):
+            self.multistatus([self.propResponse(self.standin.principal, self.properties(path), wanted)])
+            return
+        home, calendar, name = self.resolve()
+        is_home = home and path.rstrip('/') == self.standin.home.rstrip('/')
+        if not home or (calendar is None and not is_home) or \
+                (name is not None and name not in calendar.objects):
+            self.reply(404)
+            return
+        responses = []
+        if calendar is None:
+            responses.append(self.propResponse(self.standin.home, self.properties(path), wanted))
+            if depth != '0':
+                for c in self.standin.calendars.values():
+                    responses.append(self.propResponse(self.standin.home + c.name + '/',
+                                                       self.properties(path, c), wanted))
+        elif name is None:
+            base = self.standin.home + calendar.name + '/'
+            responses.append(self.propResponse(base, self.properties(path, calendar), wanted))
+            if depth != '0':
+                for n in calendar.objects:
+                    responses.append(self.propResponse(base + n, self.properties(path, calendar, n), wanted))
+        else:
+            responses.append(self.propResponse(path, self.properties(path, calendar, name), wanted))
+        self.multistatus(responses)
+
+    # ---- REPORT ----
+
+    def objectResponse(self, calendar, name, with_data=True):
+        etag, data, _ = calendar.objects[name]
+        props = [element(DAV + 'getetag', etag)]
+        if with_data:
+            props.append(element(CALDAV + 'calendar-data', data))
+        return element(DAV + 'response', children=[
+            href(self.standin.home + calendar.name + '/' + name),
+            element(DAV + 'propstat', children=[element(DAV + 'prop', children=props),
+                                                element(DAV + 'status', 'HTTP/1.1 200 OK')])])
+
+    def timeRange(self, root):
+        time_range = root.find('.//' + CALDAV + 'time-range')
+        start = parseDateValue(time_range.get('start'), {})
+        end = parseDateValue(time_range.get('end'), {})
+        return start, end
+
+    def do_REPORT(self):
+        self.begin()
+        _, calendar, _ = self.resolve()
+        if calendar is None:
+            self.reply(404)
+            return
+        root = ElementTree.fromstring(self.body())
+        base = self.standin.home + calendar.name + '/'
+        with self.standin.lock:                                                 # a consistent view while writers run
+            if root.tag == DAV + 'sync-collection':
+                changed = calendar.changedSince(root.findtext(DAV + 'sync-token'))
+                if changed is None:
+                    self.reply(403, '<?xml version="1.0"?><d:error xmlns:d="DAV:"><d:valid-sync-token/></d:error>')
+                    return
+                responses = []
+                for name in sorted(changed):
+                    if name in calendar.objects:
+                        responses.append(self.objectResponse(calendar, name, with_data=False))
+                    else:
+                        responses.append(element(DAV + 'response', children=[
+                            href(base + name), element(DAV + 'status', 'HTTP/1.1 404 Not Found')]))
+                self.multistatus(responses, SYNC_PREFIX + str(calendar.token))
+            elif root.tag == CALDAV + 'calendar-multiget':
+                names = [h.text.rsplit('/', 1)[-1] for h in root.findall(DAV + 'href')]
+                self.multistatus([self.objectResponse(calendar, n) for n in names if n in calendar.objects])
+            elif root.tag == CALDAV + 'calendar-query':
+                start, end = self.timeRange(root)
+                names = [n for n in calendar.objects if next(calendar.occurrences(n, start, end), None)]
+                self.multistatus([self.objectResponse(calendar, n) for n in names])
+            elif root.tag == CALDAV + 'free-busy-query':
+                start, end = self.timeRange(root)
+                periods = sorted(o for n in calendar.objects for o in calendar.occurrences(n, start, end))
+                lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//caldav stand-in//EN',
+                         'BEGIN:VFREEBUSY', 'DTSTART:' + utc(start), 'DTEND:' + utc(end)]
+                lines += ['FREEBUSY:{}/{}'.format(utc(max(s, start)), utc(min(f, end))) for s, f in periods]
+                lines += ['END:VFREEBUSY', 'END:VCALENDAR']
+                self.reply(200, '\r\n'.join(lines) + '\r\n', 'text/calendar; charset=utf-8')
+            else:
+                self.reply(501)
+
+    # ---- objects ----
+
+    def do_GET(self):
+        self.begin()
+        _, calendar, name = self.resolve()
+        if calendar is None or name not in calendar.objects:
+            self.reply(404)
+            return
+        etag, data, _ = calendar.objects[name]
+        self.reply(200, data, 'text/calendar; charset=utf-8', {'ETag': etag})
+
+    def do_PUT(self):
+        self.begin()
+        _, calendar, name = self.resolve()
+        data = self.body()
+        if calendar is None or name is None:
+            self.reply(409)
+            return
+        with self.standin.lock:
+            existing = calendar.objects.get(name)
+            if self.headers.get('If-None-Match') == '*' and existing is not None:
+                self.reply(412)
+                return
+            if_match = self.headers.get('If-Match')
+            if if_match is not None and (existing is None or existing[0] != if_match):
+                self.reply(412)
+                return
+            etag = calendar.put(name, data)
+        self.reply(204 if existing else 201, headers={'ETag': etag})
+
+    def do_DELETE(self):
+        self.begin()
+        _, calendar, name = self.resolve()
+        with self.standin.lock:
+            if calendar is None or name not in calendar.objects:
+                self.reply(404)
+                return
+            calendar.delete(name)
+        self.reply(204)
+
+    def do_OPTIONS(self):
+        self.begin()
+        self.reply(200, headers={'DAV': '1, 3, calendar-access, extended-mkcol',
+                                 'Allow': 'OPTIONS, GET, PUT, DELETE, PROPFIND, REPORT'})
+
+
+def main():
+    args = argparse.ArgumentParser(description='CalDAV stand-in for the Nextcloud calendar skill')
+    args.add_argument('--port', type=int, default=8008)
+    args.add_argument('--user', default='bench')
+    args.add_argument('--events', type=int, default=500, help='events per calendar')
+    args.add_argument('--recurring', type=float, default=0.1, help='fraction of events with an RRULE')
+    args.add_argument('--latency-ms', type=float, default=0.0, help='delay added to every request')
+    args = args.parse_args()
+    standin = CalDAVStandIn(user=args.user, events=args.events, recurring=args.recurring,
+                            latency=args.latency_ms / 1000.0, port=args.port)
+    print('serving {} calendars of {} events at {} (user {})'.format(
+          len(standin.calendars), args.events, standin.url, args.user))
+    try:
+        standin.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# End-to-end load benchmark: drives the skill's intent handlers with Mycroft
+# messages against the in-process CalDAV stand-in (benchmarks/caldavserver.py)
+# and reports latency and throughput of the list and add flows.
+#
+#   python benchmarks/endtoend.py [--events 500] [--recurring 0.1] [--latency-ms 20]
+#                                 [--lists 200] [--adds 50]
+#
+# Needs mycroft-core importable, as the skill itself does. Speech is captured
+# instead of sent to TTS, the pause between spoken events is set to zero, and
+# get_response/ask_yesno answer from a script, so the numbers are the skill's
+# own time: parsing, resolving, the store and the server round trips.
+import argparse
+import importlib.util
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SKILL_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+from caldavserver import CalDAVStandIn
+from mycroft.messagebus.message import Message
+
+LIST_UTTERANCES = ['what is on my calendar today', 'what am i up to this week',
+                   'tell me my schedule tomorrow', 'what does madison have going on this weekend',
+                   'what is on the family calendar tomorrow', 'what is milo up to next week',
+                   'how busy am i this week']
+ADD_UTTERANCE = 'add an event to my calendar on friday at 3pm for an hour'
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+# load the skill package the way mycroft does
+def loadSkill():
+    spec = importlib.util.spec_from_file_location('nextcloud_calendar_skill',
+                                                  os.path.join(SKILL_DIR, '__init__.py'),
+                                                  submodule_search_locations=[SKILL_DIR])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+# a skill instance wired to the stand-in, with speech and prompts scripted
+def makeSkill(module, standin, data_dir):
+    skill = module.create_skill()
+    skill.config_core = {}
+    skill.settings = {'server_url': standin.url, 'user': standin.user, 'password': 'bench',
+                      'refresh_interval': 60}
+    skill.file_system.path = data_dir
+    skill.spoken = []
+    skill.answers = []
+    skill.speak = lambda utterance, *args, **kwargs: skill.spoken.append(utterance)
+    skill.speak_dialog = lambda key, data=None, *args, **kwargs: skill.spoken.append(key)
+    skill.get_response = lambda dialog, *args, **kwargs: skill.answers.pop(0)
+    skill.ask_yesno = lambda prompt, data=None: 'yes'
+    skill.set_context = lambda *args, **kwargs: None
+    skill.add_event = lambda *args, **kwargs: None
+    skill.initialize()
+    return skill
+
+
+def report(name, latencies, total):
+    print('{:<12} {:>6} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.1f}'.format(
+          name, len(latencies), percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000,
+          max(latencies) * 1000, len(latencies) / total))
+
+
+def run(name, skill, handler, messages, before=None):
+    latencies = []
+    begin = time.perf_counter()
+    for message in messages:
+        if before is not None:
+            before(message)
+        t = time.perf_counter()
+        handler(message)
+        latencies.append(time.perf_counter() - t)
+    report(name, latencies, time.perf_counter() - begin)
+    return latencies
+
+
+def main():
+    args = argparse.ArgumentParser(description='end-to-end benchmark against the CalDAV stand-in')
+    args.add_argument('--events', type=int, default=500, help='events per calendar')
+    args.add_argument('--recurring', type=float, default=0.1, help='fraction of events with an RRULE')
+    args.add_argument('--latency-ms', type=float, default=20.0, help='delay added to every request')
+    args.add_argument('--lists', type=int, default=200, help='list intents to send')
+    args.add_argument('--adds', type=int, default=50, help='add intents to send')
+    args = args.parse_args()
+
+    standin = CalDAVStandIn(events=args.events, recurring=args.recurring,
+                            latency=args.latency_ms / 1000.0).start()
+    module = loadSkill()
+    module.EVENT_PAUSE = 0                                                      # measure the skill, not the pacing
+    data_dir = tempfile.mkdtemp(prefix='ncal-bench-')
+    skill = makeSkill(module, standin, data_dir)
+    skill.prefetcher.stop()                                                     # every sync below is driven by intents
+    try:
+        print('{} calendars x {} events, {:.0%} recurring, {:.0f} ms per request'.format(
+              len(standin.calendars), args.events, args.recurring, args.latency_ms))
+        print('{:<12} {:>6} {:>9} {:>9} {:>9} {:>9}'.format('flow', 'n', 'p50 ms', 'p99 ms', 'max ms', 'per s'))
+
+        messages = [Message('intent', {'utterance': u}) for u in LIST_UTTERANCES]
+        run('list cold', skill, skill.handle_list_events_intent, messages)   # first query per calendar syncs it
+        messages = [Message('intent', {'utterance': u})
+                    for u in itertools.islice(itertools.cycle(LIST_UTTERANCES), args.lists)]
+        run('list warm', skill, skill.handle_list_events_intent, messages)
+
+        names = ('Bench Event {}'.format(i) for i in itertools.count())
+        def script(message):
+            skill.answers[:] = [next(names)]                                    # only the event name is asked for
+        messages = [Message('intent', {'utterance': ADD_UTTERANCE}) for _ in range(args.adds)]
+        run('add', skill, skill.handle_add_event_intent, messages, before=script)
+
+        queued = len(skill.outbox)
+        begin = time.perf_counter()
+        skill.flusher.wake()
+        while len(skill.outbox) and time.perf_counter() - begin < 120:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - begin
+        print('outbox flush: {} events in {:.2f} s ({:.1f} per s), {} left'.format(
+              queued, elapsed, queued / elapsed if elapsed else 0, len(skill.outbox)))
+        print('requests served: {}'.format(', '.join('{} {}'.format(k, v)
+                                                     for k, v in sorted(standin.requests.items()))))
+        print('stage latency (ms, p50 / p99):')
+        for intent, stages in skill.tracer.summary().items():
+            print('  {:<6} {}'.format(intent, '  '.join('{} {:.1f}/{:.1f}'.format(stage, s['p50_ms'], s['p99_ms'])
+                                                        for stage, s in stages.items())))
+    finally:
+        skill.shutdown()
+        standin.stop()
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Compare ncal.eventindex.EventIndex against the list of event dicts the store
+# used to build for every query: memory held for a household's worth of cached
+# single events, and the time of day and week range queries over them. A few
+# long events (a school year, a semester) are mixed in, and the index is also
+# timed with them bisected like the rest, as before they were kept apart.
+#
+#   python benchmarks/eventindex.py [number of events]
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime as dt
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from dateutil import tz
+from ncal.eventindex import EventIndex
+
+TZ = tz.gettz('America/Chicago')
+TITLES = ['Soccer practice', 'Piano lesson', 'Dentist', 'Standup', 'Dinner with the Lowes',
+          'School pickup', 'Swim meet', 'Book club', 'Gym', 'Parent teacher conference']
+EPOCH = dt(2021, 1, 1, tzinfo=TZ).timestamp()
+
+
+# (summary, start, end, all_day) rows over three years, as sqlite returns them
+def makeRows(n, seed=0):
+    rand = random.Random(seed)
+    rows = [('School year', dt(2021, 8, 16, tzinfo=TZ).timestamp(), dt(2022, 6, 12, tzinfo=TZ).timestamp(), 1),
+            ('Fall semester', dt(2021, 8, 23, tzinfo=TZ).timestamp(), dt(2021, 12, 18, tzinfo=TZ).timestamp(), 1),
+            ('Kitchen remodel', dt(2022, 2, 7, 8, tzinfo=TZ).timestamp(), dt(2022, 3, 25, 17, tzinfo=TZ).timestamp(), 0)]
+    for i in range(n):
+        start = EPOCH + rand.randrange(3 * 365 * 96) * 900
+        if rand.random() < 0.1:                                                 # all-day: local midnight to midnight
+            day = dt.fromtimestamp(start, TZ).date()
+            midnight = dt(day.year, day.month, day.day, tzinfo=TZ)
+            rows.append((rand.choice(TITLES), midnight.timestamp(), (midnight + timedelta(1)).timestamp(), 1))
+        else:
+            rows.append((rand.choice(TITLES) + ' {}'.format(i % 50) * (rand.random() < 0.3),
+                         start, start + rand.choice((1800, 3600, 5400, 7200)), 0))
+    return rows
+
+
+# what the store built per event before: a dict with two datetimes
+def makeDicts(rows):
+    return [{'name': summary,
+             'start': dt.fromtimestamp(s, TZ).date() if all_day else dt.fromtimestamp(s, TZ),
+             'end': dt.fromtimestamp(e, TZ).date() if all_day else dt.fromtimestamp(e, TZ)}
+            for summary, s, e, all_day in rows]
+
+
+def dictSearch(events, start, end):
+    result = []
+    for e in events:
+        s, f = e['start'], e['end']
+        if not isinstance(s, dt):
+            s = dt(s.year, s.month, s.day, tzinfo=TZ)
+            f = dt(f.year, f.month, f.day, tzinfo=TZ)
+        if s < end and f > start:
+            result.append(e)
+    return result
+
+
+def measure(build):
+    tracemalloc.start()
+    value = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, size
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    rows = makeRows(n)
+    rand = random.Random(1)
+    windows = []
+    for _ in range(500):
+        start = EPOCH + rand.randrange(3 * 365) * 86400
+        windows.append((start, start + rand.choice((86400, 7 * 86400))))
+
+    events, dict_bytes = measure(lambda: makeDicts(rows))
+    index, index_bytes = measure(lambda: EventIndex(rows))
+    bisected = EventIndex(rows, long_after=float('inf'))                        # long events in the columns too
+    print('{} events: dicts {:.1f} MB ({:.0f} B/event), index {:.1f} MB ({:.0f} B/event)'.format(
+          n, dict_bytes / 1e6, dict_bytes / n, index_bytes / 1e6, index_bytes / n))
+
+    begin = time.perf_counter()
+    expected = [len(dictSearch(events, dt.fromtimestamp(s, TZ), dt.fromtimestamp(e, TZ))) for s, e in windows]
+    dict_time = time.perf_counter() - begin
+    begin = time.perf_counter()
+    found = [len(index.search(s, e)) for s, e in windows]
+    index_time = time.perf_counter() - begin
+    begin = time.perf_counter()
+    found_bisected = [len(bisected.search(s, e)) for s, e in windows]
+    bisected_time = time.perf_counter() - begin
+    assert found == expected == found_bisected, 'index and linear scan disagree'
+    print('{} queries: dict list {:.2f} ms/query, index {:.3f} ms/query ({:.0f}x), {:.1f} events/query'.format(
+          len(windows), dict_time / len(windows) * 1000, index_time / len(windows) * 1000,
+          dict_time / index_time, sum(found) / len(found)))
+    print('long events bisected too: {:.3f} ms/query ({:.0f}x slower)'.format(
+          bisected_time / len(windows) * 1000, bisected_time / index_time))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Compare the streaming extractor in ncal.ical against the per-event vobject
+# path searchEvents used to take, on a synthetic corpus of calendar objects.
+#
+#   python benchmarks/icalparse.py [number of events]
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import vobject
+from ncal.ical import iterEventsFast
+
+EVENT = '''BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//Sabre//Sabre VObject 4.3.0//EN
+BEGIN:VEVENT
+UID:{uid}
+DTSTAMP:20210101T000000Z
+{start}
+{end}
+SUMMARY:{summary}
+DESCRIPTION:Bring water\\, shin guards and the orange slices. This line is l
+ ong enough that it gets folded onto a continuation line like real servers do
+ATTENDEE;CN=Madison;PARTSTAT=ACCEPTED:mailto:madison@example.com
+{rrule}BEGIN:VALARM
+ACTION:DISPLAY
+TRIGGER:-PT15M
+END:VALARM
+END:VEVENT
+END:VCALENDAR
+'''
+
+
+def makeCorpus(n, seed=0):
+    rand = random.Random(seed)
+    corpus = []
+    for i in range(n):
+        day = '2021{:02d}{:02d}'.format(rand.randint(1, 12), rand.randint(1, 28))
+        kind = rand.random()
+        if kind < 0.15:                                                         # all-day
+            start = 'DTSTART;VALUE=DATE:{}'.format(day)
+            end = 'DTEND;VALUE=DATE:{}'.format(day)
+        elif kind < 0.6:                                                        # utc
+            start = 'DTSTART:{}T{:02d}0000Z'.format(day, rand.randint(0, 20))
+            end = 'DTEND:{}T{:02d}3000Z'.format(day, rand.randint(21, 23))
+        else:                                                                   # olson TZID
+            start = 'DTSTART;TZID=America/Chicago:{}T{:02d}0000'.format(day, rand.randint(0, 20))
+            end = 'DTEND;TZID=America/Chicago:{}T{:02d}3000'.format(day, rand.randint(21, 23))
+        rrule = 'RRULE:FREQ=WEEKLY;COUNT=10\n' if rand.random() < 0.1 else ''
+        corpus.append(EVENT.format(uid='event-{}'.format(i), start=start, end=end, rrule=rrule,
+                                   summary='Practice {}'.format(i)))
+    return corpus
+
+
+def vobjectPath(data):
+    vevent = vobject.readOne(data).vevent
+    return vevent.summary.value.strip(), vevent.dtstart.value, vevent.dtend.value
+
+
+def fastPath(data):
+    e = next(iterEventsFast(data))
+    return e['summary'], e['start'], e['end']
+
+
+# compare wall-clock times: for ambiguous local times vobject (pytz) picks the
+# second occurrence, while RFC 5545 (and the fast path) use the first
+def wallClock(event):
+    return tuple(v.replace(tzinfo=None) if hasattr(v, 'tzinfo') else v for v in event)
+
+
+def timeIt(func, corpus):
+    begin = time.perf_counter()
+    results = [func(data) for data in corpus]
+    return time.perf_counter() - begin, results
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    corpus = makeCorpus(n)
+    print('corpus: {} events, {:.1f} MB'.format(n, sum(len(c) for c in corpus) / 1e6))
+
+    fast_time, fast = timeIt(fastPath, corpus)
+    slow_time, slow = timeIt(vobjectPath, corpus)
+    mismatches = sum(1 for a, b in zip(fast, slow) if wallClock(a) != wallClock(b))
+
+    print('vobject:   {:8.3f}s  {:10.0f} events/s'.format(slow_time, n / slow_time))
+    print('streaming: {:8.3f}s  {:10.0f} events/s'.format(fast_time, n / fast_time))
+    print('speedup:   {:8.1f}x'.format(slow_time / fast_time))
+    print('mismatches: {}'.format(mismatches))
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
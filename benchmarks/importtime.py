@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Import-time budget for the skill module. Mycroft loads every skill at boot,
+# so the skill's own imports (beyond mycroft itself) should stay small.
+#
+#   python benchmarks/importtime.py [budget in ms]
+#
+# Prints the slowest imports from `python -X importtime` and exits non-zero
+# when loading the skill takes longer than the budget.
+import os
+import subprocess
+import sys
+
+SKILL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BUDGET_MS = 100
+
+# run in a fresh interpreter: mycroft's own modules are imported first since
+# they are shared by every skill, then the skill is loaded as mycroft does
+CHILD = '''
+import importlib.util, sys, time
+import adapt.intent, mycroft.skills.core, mycroft.util.parse, mycroft.util.time
+sys.stderr.write('-- skill import --\\n')
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('nextcloud_calendar_skill', {init!r},
+                                              submodule_search_locations=[{path!r}])
+module = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = module
+spec.loader.exec_module(module)
+module.create_skill
+print((time.perf_counter() - start) * 1000)
+'''
+
+
+def main():
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else BUDGET_MS
+    path = os.path.abspath(SKILL_DIR)
+    child = CHILD.format(init=os.path.join(path, '__init__.py'), path=path)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', child],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    elapsed = float(result.stdout.strip().splitlines()[-1])
+
+    lines = result.stderr.split('-- skill import --\n', 1)[-1].splitlines()
+    rows = []
+    for line in lines:
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                rows.append((int(cumulative), name.rstrip()))
+    rows.sort(reverse=True)
+    print('slowest imports during skill load (cumulative us):')
+    for cumulative, name in rows[:15]:
+        print('{:>10}  {}'.format(cumulative, name))
+    print('skill import: {:.1f} ms (budget {:.0f} ms)'.format(elapsed, budget))
+    return 1 if elapsed > budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
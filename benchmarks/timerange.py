@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# Property checks and a benchmark for ncal.timerange.TimeRangeResolver.
+#
+# Every phrase the grammar can produce is resolved against fixed clocks covering
+# every day of a year (including both DST transitions) and checked against the
+# invariants below. Then thousands of phrases are resolved with and without the
+# per-day memo.
+#
+#   python benchmarks/timerange.py [number of phrases]
+import itertools
+import os
+import random
+import sys
+import time
+from datetime import datetime as dt
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from dateutil import tz
+from ncal.timerange import DAYS_OF_WEEK, MONTHS, PARTS_OF_DAY, TimeRangeResolver
+
+TZ = tz.gettz('America/Chicago')
+TIMES = (['day', 'today', 'tomorrow', 'week', 'weekend'] + DAYS_OF_WEEK + list(PARTS_OF_DAY) +
+         MONTHS + ['march 3rd', 'june 12th', 'december 1st', 'october 22', 'january 31st'])
+PHRASES = [' '.join(w for w in combo if w) for combo in itertools.product(['', 'this', 'next'], TIMES)]
+
+
+def check(phrase, now, window):
+    errors = []
+    if window is None:
+        return ['no window']
+    start, end = window
+    today = now.date()
+    if not start < end:
+        errors.append('empty window')
+    if start.date() < today:
+        errors.append('starts before today')
+    words = phrase.split()
+    word = words[-1]
+    if words[0] == 'next' and word != 'tomorrow' and word not in MONTHS:
+        this = TimeRangeResolver(clock=lambda: now, tz=TZ).resolve(' '.join(['this'] + words[1:]))
+        if not start >= this[0]:
+            errors.append('next window before this window')
+    if word in DAYS_OF_WEEK and (start.weekday() != DAYS_OF_WEEK.index(word) or end - start > timedelta(days=1, hours=1)):
+        errors.append('not a single {}'.format(word))
+    if word in ('today', 'day') and words[0] != 'next' and start.date() != today:
+        errors.append('today is not today')
+    if word == 'week' and end.weekday() != 6:
+        errors.append('week does not end on sunday midnight')
+    if word == 'weekend' and (start.weekday() not in (5, 6) or end.weekday() != 0):
+        errors.append('weekend is not saturday-sunday')
+    if word in PARTS_OF_DAY and (start.hour, end.hour) != (PARTS_OF_DAY[word][0], PARTS_OF_DAY[word][1] % 24):
+        errors.append('wrong hours for {}'.format(word))
+    if (start.hour, start.minute) not in [(0, 0)] + [(h, 0) for h, _ in PARTS_OF_DAY.values()]:
+        errors.append('start not aligned: {}'.format(start))
+    return errors
+
+
+def properties():
+    failures = 0
+    clocks = [dt(2021, 1, 1, hour, 30, tzinfo=TZ) + timedelta(days) for days in range(366) for hour in (0, 9, 23)]
+    for now in clocks:
+        resolver = TimeRangeResolver(clock=lambda: now, tz=TZ)
+        for phrase in PHRASES:
+            for error in check(phrase, now, resolver.resolve(phrase)):
+                failures += 1
+                if failures <= 20:
+                    print('{} @ {}: {}'.format(phrase, now, error))
+    print('properties: {} phrases x {} clocks, {} failures'.format(len(PHRASES), len(clocks), failures))
+    return failures
+
+
+def benchmark(n):
+    rand = random.Random(0)
+    phrases = [rand.choice(PHRASES) for _ in range(n)]
+    now = dt(2021, 3, 14, 9, 0, tzinfo=TZ)
+
+    begin = time.perf_counter()
+    for phrase in phrases:
+        TimeRangeResolver(clock=lambda: now, tz=TZ).resolve(phrase)             # fresh resolver: no memo
+    cold = time.perf_counter() - begin
+
+    resolver = TimeRangeResolver(clock=lambda: now, tz=TZ)
+    begin = time.perf_counter()
+    for phrase in phrases:
+        resolver.resolve(phrase)
+    warm = time.perf_counter() - begin
+
+    print('resolve {} phrases: {:.1f} us/phrase uncached, {:.1f} us/phrase memoised'.format(
+          n, cold / n * 1e6, warm / n * 1e6))
+
+
+def main():
+    failures = properties()
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,17 @@
+from .aioloop import LoopThread, cancellable
+from .bulk import Progress, exportEvents, importEvents, iterComponents
+from .digest import DayDigest, digestEvents
+from .directory import CalendarDirectory, soundex
+from .eventindex import EventIndex
+from .ical import isAllDay, parseEvents, startKey
+from .intervals import clipIntervals, findFreeSlots, freeBlocks, mergeIntervals, totalDuration
+from .outbox import Outbox
+from .pool import CalDAVPool
+from .prefetch import PrefetchScheduler
+from .recurrence import OccurrenceCache, isRecurring, iterOccurrences
+from .resilience import CircuitBreaker, CircuitOpen, DeadlineExceeded, Unavailable, currentDeadline, deadline, withDeadline
+from .store import EventStore
+from .sync import syncCalendar, calendarCollections, calendarCTag, calendarQuery, freeBusyQuery
+from .timerange import TimeRangeResolver
+from .tracing import Histogram, Tracer, traced
+from .writer import CREATED, EXISTS, Rejected, WriteError, eventUID, putEvents
@@ -0,0 +1,92 @@
+# Copyright 2021 M. Ditsworth
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import functools
+import threading
+from concurrent.futures import CancelledError
+
+
+class LoopThread(object):
+    """An asyncio event loop on a daemon thread, shared by every intent.
+
+    Handlers hand work to the loop with run() or map() and wait on the result;
+    cancelAll() cancels everything in flight, and the waiting handlers get a
+    CancelledError straight away. caldav and requests are blocking, so the
+    network calls themselves run on an executor via run_in_executor: a
+    cancelled call is abandoned (its result is dropped when it finishes)
+    rather than torn down mid-request.
+    """
+    def __init__(self, name='calendar-loop'):
+        import asyncio                                                          # imported on first use to keep skill load fast
+        self.name = name
+        self.loop = asyncio.new_event_loop()
+        self._lock = threading.Lock()
+        self._futures = set()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.loop.run_forever, name=self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self.cancelAll()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def join(self, timeout=None):
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    # schedule coro on the loop, returning a concurrent.futures.Future
+    def submit(self, coro):
+        import asyncio
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    # run coro on the loop and wait for its result; raises CancelledError after cancelAll()
+    def run(self, coro):
+        return self.submit(coro).result()
+
+    # fn(item) for every item, concurrently on executor, awaited together from the loop.
+    # Returns the results in order
+    def map(self, fn, items, executor):
+        import asyncio
+        async def gather():
+            return await asyncio.gather(*(self.loop.run_in_executor(executor, fn, item)
+                                          for item in items))
+        return self.run(gather())
+
+    # cancel every coroutine in flight; returns how many were cancelled
+    def cancelAll(self):
+        with self._lock:
+            futures = list(self._futures)
+        return sum(1 for f in futures if f.cancel())
+
+    def _discard(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+
+# method decorator: a CancelledError (the user said "stop") ends the method quietly
+def cancellable(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        except CancelledError:
+            return None
+    return wrapper
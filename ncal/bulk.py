@@ -0,0 +1,205 @@
+# Copyright 2021 M. Ditsworth
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import hashlib
+import re
+import time
+from datetime import timedelta
+
+from .ical import splitContentLine, unfoldLines
+from .sync import calendarQuery
+from .writer import CREATED, EXISTS, WriteError, putEvents
+
+CRLF = '\r\n'
+PRODID = '-//mycroft-nextcloud-calendar//bulk//EN'
+IMPORT_BATCH = 50                                                               # calendar objects in flight per batch
+EXPORT_CHUNK = timedelta(days=31)                                               # time range fetched per calendar-query
+FULL_CALENDAR_DATA = '<c:calendar-data/>'                                       # whole objects, not just EVENT_PROPS
+SAFE_NAME = re.compile(r'^[A-Za-z0-9@._-]{1,200}$')
+
+
+class Progress(object):
+    """Running totals of an import or export, handed to `callback` (if any)
+    as a summary dict after every batch or chunk."""
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.events = 0
+        self.created = 0
+        self.exists = 0
+        self.failed = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+
+    def summary(self):
+        seconds = time.monotonic() - self.started
+        return {'events': self.events, 'created': self.created, 'exists': self.exists,
+                'failed': self.failed, 'bytes': self.bytes, 'seconds': seconds,
+                'events_per_second': self.events / seconds if seconds else 0.0}
+
+    def report(self):
+        if self.callback is not None:
+            self.callback(self.summary())
+
+
+# yield (NAME, [raw lines]) for every component directly inside a VCALENDAR
+# (VEVENT, VTIMEZONE, ...), reading lines one at a time; folding is kept as is
+def iterComponents(lines):
+    depth = 0
+    name, current = None, None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if not line:
+            continue
+        if current is not None:
+            current.append(line)
+        if line[:1] in (' ', '\t'):                                             # a folded line never begins or ends one
+            continue
+        upper = line[:6].upper()
+        if upper.startswith('BEGIN:'):
+            depth += 1
+            if depth == 2:
+                name, current = line[6:].strip().upper(), [line]
+        elif upper.startswith('END:'):
+            depth -= 1
+            if depth == 1 and current is not None:
+                yield name, current
+                name, current = None, None
+            depth = max(depth, 0)
+
+
+# value of a top-level property of a component (not of a nested VALARM), or None
+def componentProperty(lines, prop):
+    depth = 0
+    for line in unfoldLines(CRLF.join(lines[1:-1])):
+        upper = line[:6].upper()
+        if upper.startswith('BEGIN:'):
+            depth += 1
+        elif upper.startswith('END:'):
+            depth -= 1
+        elif not depth and line[:len(prop)].upper() == prop:
+            name, _, value = splitContentLine(line)
+            if name == prop:
+                return value.strip()
+    return None
+
+
+# one iCalendar object around components, with the VTIMEZONEs they refer to
+def wrapObject(components, timezones):
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:' + PRODID]
+    text = CRLF.join(line for component in components for line in component)
+    for tzid, component in timezones.items():
+        if 'TZID=' + tzid in text or 'TZID="{}"'.format(tzid) in text:
+            lines.extend(component)
+    for component in components:
+        lines.extend(component)
+    lines.append('END:VCALENDAR')
+    return CRLF.join(lines) + CRLF
+
+
+# the object name an imported UID is stored under; odd UIDs are hashed
+def resourceName(uid):
+    return uid if SAFE_NAME.match(uid) else hashlib.sha1(uid.encode('utf-8')).hexdigest()
+
+
+# yield (uid, ical) for every event of an .ics stream, one calendar object per UID.
+# Overrides (RECURRENCE-ID) go in the object of their master when they follow it, as
+# exporters write them; VTIMEZONEs are kept since events after them may refer to them
+def iterImportObjects(lines):
+    timezones = {}
+    group_uid, group = None, []
+    for name, component in iterComponents(lines):
+        if name == 'VTIMEZONE':
+            timezones[componentProperty(component, 'TZID')] = component
+            continue
+        if name != 'VEVENT':
+            continue
+        uid = componentProperty(component, 'UID')
+        if uid is None:                                                         # CalDAV requires one, so make it stable
+            uid = hashlib.sha1(CRLF.join(component).encode('utf-8')).hexdigest()
+            component.insert(1, 'UID:' + uid)
+        if group and uid != group_uid:
+            yield group_uid, wrapObject(group, timezones)
+            group = []
+        group_uid = uid
+        group.append(component)
+    if group:
+        yield group_uid, wrapObject(group, timezones)
+
+
+# PUT one batch and add the results to progress
+def _upload(client, calendar_url, batch, executor, progress):
+    results = putEvents(client, calendar_url, batch, executor)
+    errors = [result for _, result in results if isinstance(result, Exception)]
+    progress.events += len(results)
+    progress.created += sum(1 for _, result in results if result == CREATED)
+    progress.exists += sum(1 for _, result in results if result == EXISTS)
+    progress.failed += len(errors)
+    progress.report()
+    if errors and len(errors) == len(results):                                  # server gone: stop instead of failing the rest
+        raise WriteError('import stopped after {} events: {}'.format(progress.events, errors[0]))
+
+
+# upload every event read from lines (e.g. an open .ics file) to the calendar, `batch`
+# objects at a time with the PUTs of a batch running concurrently on executor. Memory
+# stays at one batch however long the file is, and since objects are created with
+# If-None-Match, importing the same file again only counts them as existing.
+# progress(summary) is called after every batch; returns the final summary
+def importEvents(client, calendar_url, lines, executor, batch=IMPORT_BATCH, progress=None):
+    progress = Progress(progress)
+    items = []
+    for uid, ical in iterImportObjects(lines):
+        items.append((resourceName(uid), ical))
+        progress.bytes += len(ical)
+        if len(items) >= batch:
+            _upload(client, calendar_url, items, executor, progress)
+            items = []
+    if items:
+        _upload(client, calendar_url, items, executor, progress)
+    return progress.summary()
+
+
+# write the events of the calendar overlapping [start, end) to out as one .ics
+# stream, querying `chunk` of time at a time so only one chunk is held in memory
+# (plus the hrefs written so far: objects reaching into several chunks are written
+# once). VTIMEZONEs are written once per TZID.
+# progress(summary) is called after every chunk; returns the final summary
+def exportEvents(client, calendar_url, start, end, out, chunk=EXPORT_CHUNK, progress=None):
+    progress = Progress(progress)
+    seen, timezones = set(), set()
+    header = CRLF.join(['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:' + PRODID]) + CRLF
+    out.write(header)
+    progress.bytes += len(header)
+    cursor = start
+    while cursor < end:
+        chunk_end = min(cursor + chunk, end)
+        for href, _, data in calendarQuery(client, calendar_url, cursor, chunk_end,
+                                           calendar_data=FULL_CALENDAR_DATA):
+            if href in seen:
+                continue
+            seen.add(href)
+            for name, component in iterComponents(data.splitlines()):
+                if name == 'VTIMEZONE':
+                    tzid = componentProperty(component, 'TZID')
+                    if tzid in timezones:
+                        continue
+                    timezones.add(tzid)
+                elif name != 'VEVENT':
+                    continue
+                text = CRLF.join(component) + CRLF
+                out.write(text)
+                progress.bytes += len(text)
+            progress.events += 1
+        progress.report()
+        cursor = chunk_end
+    out.write('END:VCALENDAR' + CRLF)
+    return progress.summary()
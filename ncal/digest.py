@@ -0,0 +1,68 @@
+# Copyright 2021 M. Ditsworth
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import heapq
+
+from .ical import isAllDay
+
+
+class DayDigest(object):
+    """Running summary of one day's events.
+
+    Keeps the count, the earliest timed start, the latest timed end and the
+    `top` longest events (all-day events count as a full day), so memory does
+    not grow with the number of events added.
+    """
+    __slots__ = ('day', 'count', 'first', 'last', 'all_day', '_top', '_size', '_seq')
+
+    def __init__(self, day, top=2):
+        self.day = day
+        self.count = 0
+        self.first = None                                                       # earliest start of a timed event
+        self.last = None                                                        # latest end of a timed event
+        self.all_day = 0
+        self._top = []                                                          # min-heap of (seconds, seq, name)
+        self._size = top
+        self._seq = 0
+
+    def add(self, event):
+        start, end = event['start'], event['end']
+        self.count += 1
+        if isAllDay(start):
+            self.all_day += 1
+        else:
+            self.first = start if self.first is None else min(self.first, start)
+            self.last = end if self.last is None else max(self.last, end)
+        item = ((end - start).total_seconds(), -self._seq, event['name'])      # ties go to the earlier event
+        self._seq += 1
+        if len(self._top) < self._size:
+            heapq.heappush(self._top, item)
+        elif item > self._top[0]:
+            heapq.heapreplace(self._top, item)
+
+    # names of the longest events, longest first
+    def items(self):
+        return [name for _, _, name in sorted(self._top, reverse=True)]
+
+
+# aggregate an iterable of events into a DayDigest per local day, in day order.
+# Events are consumed one at a time, so memory is bounded by the number of days
+def digestEvents(events, tz, top=2):
+    days = {}
+    for e in events:
+        start = e['start']
+        day = start if isAllDay(start) else start.astimezone(tz).date()
+        if day not in days:
+            days[day] = DayDigest(day, top)
+        days[day].add(e)
+    return [days[day] for day in sorted(days)]
@@ -0,0 +1,165 @@
+# Copyright 2021 M. Ditsworth
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import os
+import re
+import threading
+import time
+
+DIRECTORY_VERSION = 1
+
+# ways the owner of the default calendar refers to it, including what speech
+# recognition makes of "mine"
+SELF_WORDS = ('me', 'my', 'i', 'mine', 'myself', 'my own', '9', 'mind', 'your', 'personal')
+
+SOUNDEX = {c: str(d) for d, letters in enumerate(('aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r'))
+           for c in letters}
+
+
+# american soundex of the letters in text ("milo" and "my lowe" are both M400)
+def soundex(text):
+    letters = [c for c in text.lower() if c in SOUNDEX]
+    if not letters:
+        return None
+    code = letters[0].upper()
+    last = SOUNDEX[letters[0]]
+    for c in letters[1:]:
+        digit = SOUNDEX[c]
+        if digit != '0' and digit != last:
+            code += digit
+        if c not in 'hw':                                                       # h and w do not separate equal codes
+            last = digit
+    return (code + '000')[:4]
+
+
+# the calendar name caldav and the pool use: the last segment of its href
+def calendarName(href):
+    return href.rstrip('/').rsplit('/', 1)[-1]
+
+
+class CalendarDirectory(object):
+    """The account's calendars, and an index from spoken owners to calendar names.
+
+    Built from the display names of the calendars on the server: every
+    calendar is reachable by its display name, the words in it, its possessive
+    and its calendar name (without a "-1" style suffix); the default calendar
+    (`self_calendar`) also by SELF_WORDS. resolve() tries those aliases
+    exactly, then by soundex, then by closest spelling, so recognition
+    variants like "my lowe" still find "Milo". The index and each calendar's
+    ctag are saved to `path` and reloaded on start, so resolving an owner
+    never has to wait on discovery.
+    """
+    def __init__(self, path, self_calendar='personal'):
+        self.path = path
+        self.self_calendar = self_calendar
+        self.home = None
+        self.calendars = {}                                                     # name -> {'displayname', 'ctag'}
+        self.aliases = {}                                                       # spoken alias -> name
+        self.phonetic = {}                                                      # soundex -> [names]
+        self.validated_at = None
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as fObj:
+                data = json.load(fObj)
+        except (IOError, ValueError):
+            return
+        if data.get('version') != DIRECTORY_VERSION:
+            return
+        self.home = data['home']
+        self.calendars = data['calendars']
+        self.aliases = data['aliases']
+        self.phonetic = data['phonetic']
+        self.validated_at = data.get('validated_at')
+
+    def save(self):
+        data = {'version': DIRECTORY_VERSION, 'home': self.home, 'calendars': self.calendars,
+                'aliases': self.aliases, 'phonetic': self.phonetic, 'validated_at': self.validated_at}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fObj:
+            json.dump(data, fObj)
+        os.replace(tmp, self.path)
+
+    # forget everything, e.g. after the account changed
+    def reset(self):
+        with self._lock:
+            self.home = None
+            self.calendars, self.aliases, self.phonetic = {}, {}, {}
+            self.validated_at = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    # replace the directory with [(href, displayname, ctag)] from calendarCollections.
+    # Returns True if the set of calendars or their names changed
+    def update(self, home, collections):
+        calendars = {calendarName(href): {'displayname': displayname or calendarName(href), 'ctag': ctag}
+                     for href, displayname, ctag in collections}
+        with self._lock:
+            changed = home != self.home or \
+                {n: c['displayname'] for n, c in calendars.items()} != \
+                {n: c['displayname'] for n, c in self.calendars.items()}
+            self.home = home
+            self.calendars = calendars
+            if changed:
+                self.aliases, self.phonetic = self._index(calendars)
+            self.validated_at = time.time()
+            self.save()
+        return changed
+
+    def ctag(self, name):
+        calendar = self.calendars.get(name)
+        return calendar['ctag'] if calendar is not None else None
+
+    # calendar name -> possessive, e.g. {'madison-1': "madison's", 'personal': 'your'}
+    def possessives(self):
+        return {name: self.possessive(name) for name in self.calendars}
+
+    def possessive(self, name):
+        if name == self.self_calendar:
+            return 'your'
+        displayname = self.calendars[name]['displayname'].lower()
+        return displayname + ("'" if displayname.endswith('s') else "'s")
+
+    # calendar name for a spoken owner, or None. With fuzzy=False only exact aliases match
+    def resolve(self, phrase, fuzzy=True):
+        phrase = ' '.join(phrase.lower().replace("'s", '').split())
+        name = self.aliases.get(phrase)
+        if name is not None or not fuzzy or len(phrase.replace(' ', '')) < 3:
+            return name
+        names = self.phonetic.get(soundex(phrase))
+        if names is not None and len(names) == 1:
+            return names[0]
+        import difflib                                                          # only needed for misheard names
+        close = difflib.get_close_matches(phrase, list(self.aliases), n=1, cutoff=0.75)
+        return self.aliases[close[0]] if close else None
+
+    def _index(self, calendars):
+        aliases, phonetic = {}, {}
+        for name, calendar in sorted(calendars.items()):
+            displayname = calendar['displayname'].lower()
+            spoken = {displayname, re.sub(r'-\d+$', '', name).replace('-', ' ').replace('_', ' '), name}
+            spoken.update(w for w in re.split(r'[^\w]+', displayname) if len(w) > 2)
+            if name == self.self_calendar:
+                spoken.update(SELF_WORDS)
+            for alias in spoken:
+                alias = ' '.join(alias.split())
+                if not alias:
+                    continue
+                aliases.setdefault(alias, name)                                 # the first calendar keeps a shared word
+                key = soundex(alias)
+                if key is not None and len(alias.replace(' ', '')) >= 3 and name not in phonetic.get(key, []):
+                    phonetic.setdefault(key, []).append(name)
+        return aliases, phonetic
@@ -0,0 +1,68 @@
+# Copyright 2021 M. Ditsworth
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import sys
+from array import array
+from bisect import bisect_left
+
+LONG_EVENT = 7 * 86400                                                          # seconds; longer events are scanned, not bisected
+
+
+class EventIndex(object):
+    """Immutable interval index over single (non-recurring) events.
+
+    Events are kept as columns sorted by start: epoch-second starts and ends
+    in float arrays, an all-day flag in a byte array and the summaries as
+    interned strings, so a repeated title ("Soccer practice") is stored once.
+    That is under 40 bytes per event, against nearly 300 for a dict holding
+    two datetimes. Since no event in the columns is longer than
+    `max_duration`, every one overlapping [start, end) starts in
+    [start - max_duration, end), and both ends of that slice are found with
+    bisect: a query costs O(log n + k), where k also counts the events
+    starting up to max_duration before the window. Events longer than
+    `long_after` seconds (a semester, a months-long project) would widen
+    every slice by their length, so they are kept out of the columns in a
+    short list of rows that every query scans instead.
+    """
+    __slots__ = ('starts', 'ends', 'all_day', 'names', 'max_duration', 'long')
+
+    # rows are (summary, start, end, all_day) with start/end as epoch seconds
+    def __init__(self, rows=(), long_after=LONG_EVENT):
+        rows = sorted(rows, key=lambda row: row[1])
+        self.long = [(sys.intern(row[0] or ''), row[1], row[2], int(bool(row[3])))
+                     for row in rows if row[2] - row[1] > long_after]
+        rows = [row for row in rows if row[2] - row[1] <= long_after]
+        self.starts = array('d', (row[1] for row in rows))
+        self.ends = array('d', (row[2] for row in rows))
+        self.all_day = array('b', (bool(row[3]) for row in rows))
+        self.names = [sys.intern(row[0] or '') for row in rows]
+        self.max_duration = max((e - s for s, e in zip(self.starts, self.ends)), default=0.0)
+
+    def __len__(self):
+        return len(self.starts) + len(self.long)
+
+    # positions in the columns of the events overlapping [start, end), in start order
+    def overlapping(self, start, end):
+        lo = bisect_left(self.starts, start - self.max_duration)
+        hi = bisect_left(self.starts, end, lo)
+        ends = self.ends
+        return [i for i in range(lo, hi) if ends[i] > start]
+
+    # (summary, start, end, all_day) of the events overlapping [start, end), in start order
+    def search(self, start, end):
+        found = [(self.names[i], self.starts[i], self.ends[i], self.all_day[i])
+                 for i in self.overlapping(start, end)]
+        extra = [row for row in self.long if row[1] < end and row[2] > start]
+        if extra:
+            found = sorted(found + extra, key=lambda row: row[1])
+        return found
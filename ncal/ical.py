@@ -0,0 +1,230 @@
+# Copyright 2021 M. Ditsworth
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import re
+from datetime import date
+from datetime import datetime as dt
+from datetime import time as dtime
+from datetime import timedelta
+from datetime import timezone
+
+from dateutil import tz as dateutil_tz
+
+DURATION_RE = re.compile(r'^([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+FIELDS = {'UID': 'uid', 'SUMMARY': 'summary', 'DTSTART': 'start', 'DTEND': 'end',
+          'DURATION': 'duration', 'RRULE': 'rrule', 'EXDATE': 'exdate', 'RDATE': 'rdate',
+          'RECURRENCE-ID': 'recurrence_id'}
+
+
+class UnusualContent(Exception):
+    """Raised by the fast path for content it does not handle; the object is
+    then parsed with vobject instead."""
+    pass
+
+
+# undo RFC 5545 line folding, yielding one content line at a time
+def unfoldLines(data):
+    if isinstance(data, bytes):
+        data = data.decode('utf-8', 'replace')
+    current = None
+    for line in data.splitlines():
+        if line[:1] in (' ', '\t'):                                             # continuation of the previous line
+            if current is not None:
+                current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+# split a content line into (NAME, {PARAM: value}, value)
+def splitContentLine(line):
+    colon = line.find(':')
+    if colon == -1:
+        raise UnusualContent('content line without value: {}'.format(line))
+    semi = line.find(';')
+    if semi == -1 or semi > colon:
+        return line[:colon].upper(), {}, line[colon+1:]
+    params = {}
+    i = semi
+    while i < len(line) and line[i] == ';':                                     # walk params, honouring quoted values
+        eq = line.index('=', i)
+        j = eq + 1
+        if line[j:j+1] == '"':
+            k = line.index('"', j+1)
+            value = line[j+1:k]
+            j = k + 1
+        else:
+            k = j
+            while k < len(line) and line[k] not in ';:':
+                k += 1
+            value = line[j:k]
+            j = k
+        params[line[i+1:eq].upper()] = value
+        i = j
+    return line[:semi].upper(), params, line[i+1:]
+
+
+def unescapeText(value):
+    if '\\' not in value:
+        return value
+    return (value.replace('\\n', '\n').replace('\\N', '\n').replace('\\,', ',')
+                 .replace('\\;', ';').replace('\\\\', '\\'))
+
+
+# DATE or DATE-TIME value, resolving Z and TZID; floating times stay naive
+def parseDateValue(value, params):
+    if params.get('VALUE') == 'DATE' or len(value) == 8:
+        return date(int(value[:4]), int(value[4:6]), int(value[6:8]))
+    if len(value) < 15 or value[8] != 'T':
+        raise UnusualContent('bad date-time {}'.format(value))
+    tzinfo = None
+    if value.endswith('Z'):
+        tzinfo = timezone.utc
+    elif 'TZID' in params:
+        tzinfo = dateutil_tz.gettz(params['TZID'])
+        if tzinfo is None:                                                      # custom VTIMEZONE, let vobject resolve it
+            raise UnusualContent('unknown TZID {}'.format(params['TZID']))
+    return dt(int(value[:4]), int(value[4:6]), int(value[6:8]),
+              int(value[9:11]), int(value[11:13]), int(value[13:15]), tzinfo=tzinfo)
+
+
+def parseDuration(value):
+    match = DURATION_RE.match(value)
+    if match is None:
+        raise UnusualContent('bad duration {}'.format(value))
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                         minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -duration if sign == '-' else duration
+
+
+# fill in end from duration (or the RFC 5545 defaults) once a VEVENT is complete
+def finishEvent(fields):
+    start = fields.get('start')
+    if start is None:
+        raise UnusualContent('VEVENT without DTSTART')
+    if fields.get('end') is None:
+        if 'duration' in fields:
+            fields['end'] = start + fields['duration']
+        elif isinstance(start, dt):                                             # no end or duration: zero length event,
+            fields['end'] = start                                               # or a single day for all-day events
+        else:
+            fields['end'] = start + timedelta(1)
+    fields.pop('duration', None)
+    fields.setdefault('uid', None)
+    fields.setdefault('summary', '')
+    fields.setdefault('rrule', None)
+    fields.setdefault('tzid', None)
+    fields.setdefault('exdate', [])
+    fields.setdefault('rdate', [])
+    fields.setdefault('recurrence_id', None)
+    return fields
+
+
+# yield the VEVENTs of an iCalendar object straight from the content lines
+def iterEventsFast(data):
+    depth = 0                                                                   # nesting below the VEVENT (e.g. VALARM)
+    fields = None
+    for line in unfoldLines(data):
+        if not line:
+            continue
+        upper = line[:10].upper()
+        if upper.startswith('BEGIN:'):
+            if fields is not None:
+                depth += 1
+            elif line[6:].strip().upper() == 'VEVENT':
+                fields = {}
+            continue
+        if upper.startswith('END:'):
+            if fields is None:
+                continue
+            if depth:
+                depth -= 1
+            else:
+                yield finishEvent(fields)
+                fields = None
+            continue
+        if fields is None or depth:
+            continue
+        name, params, value = splitContentLine(line)
+        key = FIELDS.get(name)
+        if key is None:
+            continue
+        if key in ('exdate', 'rdate'):                                          # comma separated, may repeat
+            for v in value.strip().split(','):
+                fields.setdefault(key, []).append(parseDateValue(v.split('/')[0], params)) # PERIOD values: keep the start
+        elif key in ('start', 'end', 'recurrence_id'):
+            fields[key] = parseDateValue(value.strip(), params)
+            if key == 'start':
+                fields['tzid'] = params.get('TZID')
+        elif key == 'duration':
+            fields[key] = parseDuration(value.strip())
+        elif key == 'summary':
+            fields[key] = unescapeText(value).strip()
+        else:
+            fields[key] = value.strip()
+
+
+# vobject parse of the same fields, for content the fast path does not handle
+def iterEventsVobject(data):
+    import vobject
+    from vobject.icalendar import TimezoneComponent
+    for vevent in vobject.readOne(data).contents.get('vevent', []):
+        start = vevent.dtstart.value
+        fields = {'start': start, 'tzid': None}
+        if isinstance(start, dt) and start.tzinfo not in (None, timezone.utc):
+            fields['tzid'] = TimezoneComponent.pickTzid(start.tzinfo)
+        if hasattr(vevent, 'dtend'):
+            fields['end'] = vevent.dtend.value
+        elif hasattr(vevent, 'duration'):
+            fields['duration'] = vevent.duration.value
+        if hasattr(vevent, 'uid'):
+            fields['uid'] = vevent.uid.value
+        if hasattr(vevent, 'summary'):
+            fields['summary'] = vevent.summary.value.strip()
+        if hasattr(vevent, 'rrule'):
+            fields['rrule'] = vevent.rrule.value
+        if hasattr(vevent, 'recurrence_id'):
+            fields['recurrence_id'] = vevent.recurrence_id.value
+        for key in ('exdate', 'rdate'):
+            fields[key] = [v[0] if isinstance(v, tuple) else v
+                           for line in vevent.contents.get(key, []) for v in line.value]
+        yield finishEvent(fields)
+
+
+# yield a dict with uid, summary, start, end, tzid and the recurrence fields
+# (rrule, exdate, rdate, recurrence_id) for every VEVENT in data
+def parseEvents(data):
+    try:
+        events = list(iterEventsFast(data))
+    except (UnusualContent, ValueError, IndexError):
+        events = iterEventsVobject(data)
+    for e in events:
+        yield e
+
+
+# True if the value is an all-day date rather than a datetime
+def isAllDay(value):
+    return isinstance(value, date) and not isinstance(value, dt)
+
+
+# sort key placing all-day dates (at midnight in tz) and datetimes on one timeline
+def startKey(value, tz=None):
+    if isAllDay(value):
+        value = dt.combine(value, dtime(), tzinfo=tz)
+    elif value.tzinfo is None:
+        value = value.replace(tzinfo=tz)
+    return value.timestamp()
@@ -0,0 +1,74 @@
+# Copyright 2021 M. Ditsworth
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from datetime import timedelta
+
+
+# merge overlapping or touching (start, end) intervals; O(n log n) for the sort
+def mergeIntervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+# clip intervals to [start, end), dropping the ones outside it
+def clipIntervals(intervals, start, end):
+    return [(max(s, start), min(e, end)) for s, e in intervals if s < end and e > start]
+
+
+# gaps of at least min_length between merged busy intervals within [start, end)
+def freeBlocks(busy, start, end, min_length=timedelta(0)):
+    free = []
+    cursor = start
+    for s, e in clipIntervals(busy, start, end):
+        if s - cursor >= min_length and s > cursor:
+            free.append((cursor, s))
+        cursor = max(cursor, e)
+    if end - cursor >= min_length and end > cursor:
+        free.append((cursor, end))
+    return free
+
+
+def totalDuration(intervals):
+    return sum((e - s for s, e in intervals), timedelta(0))
+
+
+# sweep over the busy intervals of several calendars at once, returning the
+# (start, end) gaps within [start, end) where nobody is busy for at least
+# duration, earliest first. O(n log n) in the total number of intervals.
+def findFreeSlots(busy_lists, start, end, duration, limit=None):
+    points = []
+    for busy in busy_lists:
+        for s, e in clipIntervals(busy, start, end):
+            points.append((s, 1))
+            points.append((e, -1))
+    points.sort(key=lambda p: (p[0], -p[1]))                                    # at the same instant, starts before ends
+    slots = []
+    active = 0
+    gap_start = start
+    for t, delta in points:
+        if active == 0 and delta == 1 and t - gap_start >= duration:
+            slots.append((gap_start, t))
+            if limit is not None and len(slots) >= limit:
+                return slots
+        active += delta
+        if active == 0:
+            gap_start = t
+    if end - gap_start >= duration:
+        slots.append((gap_start, end))
+    return slots[:limit] if limit is not None else slots
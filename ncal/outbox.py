@@ -0,0 +1,95 @@
+# Copyright 2021 M. Ditsworth
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import os
+import threading
+from datetime import datetime as dt
+
+
+class Outbox(object):
+    """Append-only journal of events waiting to be written to the server.
+
+    Each line of the file is a JSON record: {"op": "add", "calendar": ...,
+    "uid": ...} when an event is queued and {"op": "done", "calendar": ...,
+    "uid": ...} once the server has it. Events are keyed by calendar and uid,
+    since the same event may be added to several calendars. Lines are flushed
+    and fsync'd before add() returns, so a queued event survives a crash or
+    reload. On load the journal is replayed (later records for a key win) and
+    rewritten with only the pending events, so it never grows unbounded.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = {}                                                      # (calendar, uid) -> record, in the order queued
+        if os.path.exists(path):
+            with open(path, 'r') as fObj:
+                for line in fObj:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:                                          # torn write from a crash: skip it
+                        continue
+                    if record.get('op') == 'add':
+                        self._pending[(record['calendar'], record['uid'])] = record
+                    elif record.get('op') == 'done':
+                        self._pending.pop((record.get('calendar'), record['uid']), None)
+        self._compact()
+        self._file = open(path, 'a')
+
+    # queue an event for calendar; returns False if the same uid is already queued for it
+    def add(self, calendar, uid, name, start, end, rule=None):
+        record = {'op': 'add', 'uid': uid, 'calendar': calendar, 'name': name,
+                  'start': start.isoformat(), 'end': end.isoformat(), 'rule': rule}
+        with self._lock:
+            if (calendar, uid) in self._pending:
+                return False
+            self._append(record)
+            self._pending[(calendar, uid)] = record
+            return True
+
+    # calendar has uid on the server; drop it from the queue
+    def done(self, calendar, uid):
+        with self._lock:
+            if self._pending.pop((calendar, uid), None) is not None:
+                self._append({'op': 'done', 'calendar': calendar, 'uid': uid})
+
+    # queued events as dicts with uid, calendar, name, start, end and rule
+    def pending(self, calendar=None):
+        with self._lock:
+            records = list(self._pending.values())
+        return [{'uid': r['uid'], 'calendar': r['calendar'], 'name': r['name'],
+                 'start': dt.fromisoformat(r['start']), 'end': dt.fromisoformat(r['end']),
+                 'rule': r.get('rule')}
+                for r in records if calendar is None or r['calendar'] == calendar]
+
+    def __len__(self):
+        return len(self._pending)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def _append(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    # rewrite the journal with only the pending adds, atomically
+    def _compact(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fObj:
+            for record in self._pending.values():
+                fObj.write(json.dumps(record) + '\n')
+            fObj.flush()
+            os.fsync(fObj.fileno())
+        os.replace(tmp, self.path)
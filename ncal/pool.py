@@ -0,0 +1,125 @@
+# Copyright 2021 M. Ditsworth
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+
+from .resilience import BACKGROUND_TIMEOUT, REQUEST_TIMEOUT, CircuitBreaker, guardedSession
+
+
+# build the base dav url for a nextcloud account. server_url is a host name (https
+# is assumed) or a full http(s):// url, e.g. for a server on the local network
+def calendarHomeURL(server_url, user):
+    if not server_url.startswith(('http://', 'https://')):
+        server_url = 'https://' + server_url
+    return '{}/remote.php/dav/calendars/{}'.format(server_url.rstrip('/'), user)
+
+
+class CalDAVPool(object):
+    """Long-lived caldav clients and calendar objects.
+
+    Clients are shared per (server_url, user) so every calendar of an account
+    reuses the same keep-alive HTTP session (and the auth scheme negotiated on
+    the first request). Calendar objects are cached per
+    (server_url, user, calendar). Every request of an account goes through
+    that account's CircuitBreaker and is bounded by `timeout` seconds, or by
+    the caller's deadline if that is sooner; `failures` failed or slower than
+    `slow` seconds calls in a row open the breaker for `reset_after` seconds.
+    Background work (syncs, queued writes, bulk transfers) asks for
+    background=True and gets a separate client per account, bounded by
+    `background_timeout` instead and kept away from the breaker, so a slow
+    export neither opens it for the intents nor is refused by it.
+    Call clear() when the settings change.
+    """
+    def __init__(self, max_connections=8, timeout=REQUEST_TIMEOUT, slow=2.5, failures=3, reset_after=30.0,
+                 background_timeout=BACKGROUND_TIMEOUT):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.background_timeout = background_timeout
+        self.slow = slow
+        self.failures = failures
+        self.reset_after = reset_after
+        self._lock = threading.Lock()
+        self._breakers = {}
+        self._clients = {}
+        self._calendars = {}
+        self._principals = {}
+
+    # return the pooled client for the account, constructing it on first use
+    def client(self, server_url, user, password, background=False):
+        key = (server_url, user, background)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                import caldav                                                   # imported on first use to keep skill load fast
+                from requests.adapters import HTTPAdapter
+                client = caldav.DAVClient(url=calendarHomeURL(server_url, user),
+                                          username=user, password=password)
+                if background:
+                    client.session = guardedSession(None, self.background_timeout)
+                else:                                                           # caldav 0.8 has no timeout of its own
+                    client.session = guardedSession(self._breaker((server_url, user)), self.timeout)
+                adapter = HTTPAdapter(pool_connections=self.max_connections,
+                                      pool_maxsize=self.max_connections)
+                client.session.mount('https://', adapter)                       # allow concurrent requests to share the session
+                client.session.mount('http://', adapter)
+                self._clients[key] = client
+            return client
+
+    # the circuit breaker guarding the account's server
+    def breaker(self, server_url, user):
+        with self._lock:
+            return self._breaker((server_url, user))
+
+    def _breaker(self, key):
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker(self.failures, self.reset_after,
+                                                           slow=self.slow)
+        return breaker
+
+    # return the cached calendar object for calendar_name
+    def calendar(self, server_url, user, password, calendar_name, background=False):
+        key = (server_url, user, calendar_name, background)
+        calendar = self._calendars.get(key)
+        if calendar is None:
+            import caldav
+            client = self.client(server_url, user, password, background)
+            calURL = '{}/{}'.format(calendarHomeURL(server_url, user), calendar_name)
+            calendar = caldav.Calendar(client=client, url=calURL)
+            with self._lock:
+                calendar = self._calendars.setdefault(key, calendar)
+        return calendar
+
+    # return the cached principal for the account
+    def principal(self, server_url, user, password, background=False):
+        key = (server_url, user, background)
+        principal = self._principals.get(key)
+        if principal is None:
+            principal = self.client(server_url, user, password, background).principal()
+            with self._lock:
+                principal = self._principals.setdefault(key, principal)
+        return principal
+
+    # drop every client and calendar, closing the underlying sessions
+    def clear(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients = {}
+            self._calendars = {}
+            self._principals = {}
+            self._breakers = {}
+        for client in clients:
+            try:
+                client.session.close()
+            except Exception:
+                pass
@@ -0,0 +1,78 @@
+# Copyright 2021 M. Ditsworth
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import random
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class PrefetchScheduler(object):
+    """Calls refresh() on a daemon thread every `interval` seconds.
+
+    Each delay is jittered by +/- `jitter` (a fraction of the interval) so
+    devices sharing a server do not refresh in lockstep. After a failed
+    refresh the delay doubles, up to `max_backoff` seconds, and resets on the
+    next success.
+    """
+    def __init__(self, refresh, interval=300, jitter=0.1, max_backoff=3600, name='calendar-prefetch'):
+        self.refresh = refresh
+        self.name = name
+        self.interval = interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    # wait for the thread to finish the refresh it is in, after stop()
+    def join(self, timeout=None):
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    # run a refresh as soon as possible (e.g. after the settings changed)
+    def wake(self):
+        self._wake.set()
+
+    def nextDelay(self):
+        if self.failures:
+            delay = min(self.interval * 2 ** self.failures, self.max_backoff)
+        else:
+            delay = self.interval
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _run(self):
+        delay = 0                                                               # warm up right after the skill loads
+        while not self._stop.is_set():
+            self._wake.wait(delay)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.refresh()
+                self.failures = 0
+            except Exception as e:
+                self.failures += 1
+                log.error('{} failed ({} in a row): {}'.format(self.name, self.failures, e))
+            delay = self.nextDelay()
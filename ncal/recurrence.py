@@ -0,0 +1,119 @@
+# Copyright 2021 M. Ditsworth
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+from collections import OrderedDict
+from datetime import datetime as dt
+from datetime import time as dtime
+
+from dateutil.rrule import rrulestr
+
+from .ical import isAllDay
+
+
+def isRecurring(event):
+    return bool(event.get('rrule') or event.get('rdate'))
+
+
+# rrule works on datetimes only, so all-day dates become naive midnights
+def _asDatetime(value):
+    return dt.combine(value, dtime()) if isAllDay(value) else value
+
+
+# make a window bound comparable with the (naive or aware) occurrences of like
+def _align(value, like, all_day):
+    value = _asDatetime(value)
+    if like.tzinfo is None and value.tzinfo is not None:
+        if all_day:                                                             # all-day dates are wall-clock days in the
+            return value.replace(tzinfo=None)                                   # window's own timezone
+        return value.astimezone().replace(tzinfo=None)                          # floating times are local
+    if like.tzinfo is not None and value.tzinfo is None:
+        return value.astimezone()
+    return value
+
+
+# build the dateutil rruleset for a master event (RRULE + RDATE - EXDATE)
+def ruleSet(event):
+    dtstart = _asDatetime(event['start'])
+    text = 'RRULE:' + event['rrule'] if event.get('rrule') else ''
+    try:
+        rules = rrulestr(text, dtstart=dtstart, forceset=True)
+    except ValueError:                                                          # UNTIL in UTC against a floating DTSTART
+        rules = rrulestr(text, dtstart=dtstart, forceset=True, ignoretz=True)
+    if not text:
+        rules.rdate(dtstart)                                                    # RDATE-only events still occur on DTSTART
+    for value in event.get('rdate', []):
+        rules.rdate(_asDatetime(value))
+    for value in event.get('exdate', []):
+        rules.exdate(_asDatetime(value))
+    return rules
+
+
+# lazily yield (start, end) of the occurrences of a master event overlapping
+# [window_start, window_end), skipping those replaced by a RECURRENCE-ID override
+def iterOccurrences(event, window_start, window_end, overridden=()):
+    all_day = isAllDay(event['start'])
+    duration = _asDatetime(event['end']) - _asDatetime(event['start'])
+    like = _asDatetime(event['start'])
+    window_start = _align(window_start, like, all_day)
+    window_end = _align(window_end, like, all_day)
+    for occurrence in ruleSet(event).xafter(window_start - duration, inc=False):
+        if occurrence >= window_end:
+            break
+        start = occurrence.date() if all_day else occurrence
+        if start in overridden:
+            continue
+        end = start + duration
+        yield start, end
+
+
+# last instant a master event can cover, or None if its rule is unbounded
+def lastEnd(event):
+    rrule = (event.get('rrule') or '').upper()
+    if rrule and 'COUNT=' not in rrule and 'UNTIL=' not in rrule:
+        return None
+    duration = _asDatetime(event['end']) - _asDatetime(event['start'])
+    occurrences = list(ruleSet(event))
+    last = occurrences[-1] if occurrences else _asDatetime(event['start'])
+    return last + duration
+
+
+class OccurrenceCache(object):
+    """LRU memo of expanded occurrences.
+
+    Keys identify the master event version (e.g. calendar, href and etag) and
+    the window, so a changed event is never served from a stale expansion; old
+    entries simply age out.
+    """
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    # occurrences of event in the window, expanding on a cache miss
+    def occurrences(self, key, event, window_start, window_end, overridden=()):
+        key = (key, window_start, window_end)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        result = list(iterOccurrences(event, window_start, window_end, overridden))
+        with self._lock:
+            self._entries[key] = result
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
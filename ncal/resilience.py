@@ -0,0 +1,163 @@
+# Copyright 2021 M. Ditsworth
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+REQUEST_TIMEOUT = 5.0                                                           # seconds, when no deadline is tighter
+BACKGROUND_TIMEOUT = 30.0                                                       # seconds, for syncs and bulk transfers nobody waits on
+
+_local = threading.local()
+
+
+class Unavailable(Exception):
+    """The server could not be asked in time (or at all)."""
+
+
+class CircuitOpen(Unavailable):
+    pass
+
+
+class DeadlineExceeded(Unavailable):
+    pass
+
+
+class CircuitBreaker(object):
+    """Fails calls fast after the server has repeatedly failed or been slow.
+
+    After `failures` consecutive failed (or slower than `slow` seconds) calls
+    the breaker opens and allow() raises CircuitOpen. Once `reset_after` seconds
+    have passed a single trial call is let through: success closes the breaker,
+    failure opens it again for another `reset_after` seconds.
+    """
+    def __init__(self, failures=3, reset_after=30.0, slow=None, clock=time.monotonic):
+        self.threshold = failures
+        self.reset_after = reset_after
+        self.slow = slow
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def isOpen(self):
+        return self.opened_at is not None
+
+    # raise CircuitOpen unless a call may go to the server now
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if self.clock() - self.opened_at < self.reset_after or self._trial:
+                raise CircuitOpen('server failed {} times in a row'.format(self.failures))
+            self._trial = True                                                  # half open: one call finds out
+
+    def record(self, ok, elapsed=0.0):
+        with self._lock:
+            self._trial = False
+            if ok and (self.slow is None or elapsed <= self.slow):
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = self.clock()
+
+
+def currentDeadline():
+    return getattr(_local, 'deadline', None)
+
+
+# bound everything the current thread does inside the block to `seconds` from now (or
+# the absolute time.monotonic() value `at`, to carry a deadline onto a worker thread).
+# A nested deadline can only shorten the budget
+@contextmanager
+def deadline(seconds=None, at=None):
+    previous = currentDeadline()
+    if at is None and seconds is not None:
+        at = time.monotonic() + seconds
+    if previous is not None and (at is None or previous < at):
+        at = previous
+    _local.deadline = at
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+# seconds a request may take: `timeout`, or less if the deadline is closer
+def remaining(timeout=REQUEST_TIMEOUT):
+    at = currentDeadline()
+    if at is None:
+        return timeout
+    left = at - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded('deadline passed before the request was sent')
+    return min(timeout, left)
+
+
+_sessionClass = None
+
+
+# a requests.Session that applies the deadline/timeout to every request and reports to
+# breaker. With breaker=None (background work) the breaker is neither asked nor fed.
+# requests is imported on first use to keep skill load fast
+def guardedSession(breaker, timeout=REQUEST_TIMEOUT):
+    global _sessionClass
+    if _sessionClass is None:
+        import requests
+
+        class GuardedSession(requests.Session):
+            def request(self, method, url, **kwargs):
+                if kwargs.get('timeout') is None:
+                    kwargs['timeout'] = remaining(self.timeout)
+                if self.breaker is not None:
+                    self.breaker.allow()
+                begin = time.monotonic()
+                try:
+                    response = super(GuardedSession, self).request(method, url, **kwargs)
+                except requests.Timeout as e:
+                    self.record(False)
+                    raise DeadlineExceeded('{} {} timed out'.format(method, url)) from e
+                except requests.ConnectionError as e:
+                    self.record(False)
+                    raise Unavailable('{} {}: {}'.format(method, url, e)) from e
+                except Exception:                                               # anything else must still end a half-open trial
+                    self.record(False)
+                    raise
+                self.record(response.status_code < 500, time.monotonic() - begin)
+                return response
+
+            def record(self, ok, elapsed=0.0):
+                if self.breaker is not None:
+                    self.breaker.record(ok, elapsed)
+
+        _sessionClass = GuardedSession
+    session = _sessionClass()
+    session.breaker = breaker
+    session.timeout = timeout
+    return session
+
+
+# method decorator: run the method under a deadline of `seconds`
+def withDeadline(seconds):
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with deadline(seconds):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,235 @@
+# Copyright 2021 M. Ditsworth
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import sqlite3
+import threading
+import time
+from datetime import datetime as dt
+from datetime import time as dtime
+from datetime import timedelta
+from datetime import timezone
+
+from dateutil import tz as dateutil_tz
+
+from .eventindex import EventIndex
+from .ical import isAllDay, startKey
+from .recurrence import OccurrenceCache, isRecurring, lastEnd
+
+# bump whenever the tables change; the store is only a cache of the server,
+# so an old schema is dropped and rebuilt by the next full sync
+SCHEMA_VERSION = 3
+
+
+class EventStore(object):
+    """Persistent cache of calendar events, kept current by ncal.sync.
+
+    Events are stored per calendar url and href with their etag, and start/end
+    as epoch seconds. search() answers single events from an in-memory
+    EventIndex per calendar, built from sqlite on first use and dropped when a
+    sync changes the calendar. Recurring masters keep their rule and are
+    expanded locally by search(). The sync token and ctag
+    of every calendar are kept alongside so a reload only needs a delta sync,
+    and an unchanged calendar none at all.
+    """
+    def __init__(self, path, tz=None, occurrence_cache_size=512):
+        self.tz = tz                                                            # timezone used for all-day events (None = local)
+        self.occurrences = OccurrenceCache(occurrence_cache_size)
+        self._indexes = {}                                                      # calendar -> EventIndex
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._createTables()
+
+    def _createTables(self):
+        with self._lock, self._db:
+            version = self._db.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                self._db.execute('DROP TABLE IF EXISTS calendars')
+                self._db.execute('DROP TABLE IF EXISTS events')
+                self._db.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+            self._db.execute('''CREATE TABLE IF NOT EXISTS calendars (
+                                    url TEXT PRIMARY KEY,
+                                    sync_token TEXT,
+                                    synced_at REAL,
+                                    ctag TEXT)''')
+            self._db.execute('''CREATE TABLE IF NOT EXISTS events (
+                                    calendar TEXT,
+                                    href TEXT,
+                                    etag TEXT,
+                                    uid TEXT,
+                                    summary TEXT,
+                                    start REAL,
+                                    end REAL,
+                                    all_day INTEGER,
+                                    tzid TEXT,
+                                    rrule TEXT,
+                                    rdate TEXT,
+                                    exdate TEXT,
+                                    recurrence_id REAL,
+                                    until REAL)''')
+            self._db.execute('CREATE INDEX IF NOT EXISTS events_range ON events (calendar, start)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS events_href ON events (calendar, href)')
+
+    # epoch seconds for a date or datetime; dates are midnight in self.tz
+    def _toEpoch(self, value):
+        if isAllDay(value):
+            value = dt.combine(value, dtime(), tzinfo=self.tz)
+        return value.timestamp()
+
+    def _fromEpoch(self, value, all_day, tz=None):
+        if all_day:
+            return dt.fromtimestamp(value, self.tz).date()
+        return dt.fromtimestamp(value, tz or self.tz)
+
+    # how the original timezone of a datetime is remembered: UTC, a TZID or '' (floating)
+    def _tzidOf(self, event):
+        start = event['start']
+        if isAllDay(start) or start.tzinfo is None:
+            return ''
+        if start.tzinfo == timezone.utc or start.utcoffset().total_seconds() == 0 and not event['tzid']:
+            return 'UTC'
+        return event['tzid'] or ''
+
+    def _tzFromId(self, tzid):
+        if tzid == 'UTC':
+            return timezone.utc
+        return dateutil_tz.gettz(tzid) or self.tz if tzid else None
+
+    def _epochList(self, values):
+        return ' '.join(repr(self._toEpoch(v)) for v in values) or None
+
+    # rebuild the master event of a stored row in its original timezone
+    def _masterFromRow(self, row):
+        uid, summary, start, end, all_day, tzid, rrule, rdate, exdate = row
+        tz = self._tzFromId(tzid)
+        if all_day:
+            convert = lambda v: self._fromEpoch(v, True)
+        elif tz is None:
+            convert = lambda v: dt.fromtimestamp(v)                             # floating: naive local time
+        else:
+            convert = lambda v: dt.fromtimestamp(v, tz)
+        return {'uid': uid, 'summary': summary, 'start': convert(start), 'end': convert(end),
+                'rrule': rrule,
+                'rdate': [convert(float(v)) for v in (rdate or '').split()],
+                'exdate': [convert(float(v)) for v in (exdate or '').split()]}, convert
+
+    def _row(self, calendar, href, etag, e):
+        until = lastEnd(e) if isRecurring(e) else None
+        return (calendar, href, etag, e['uid'], e['summary'], self._toEpoch(e['start']),
+                self._toEpoch(e['end']), int(isAllDay(e['start'])), self._tzidOf(e),
+                e['rrule'], self._epochList(e['rdate']), self._epochList(e['exdate']),
+                self._toEpoch(e['recurrence_id']) if e['recurrence_id'] is not None else None,
+                self._toEpoch(until) if until is not None else None)
+
+    # (sync_token, synced_at) of the calendar, or (None, None) if never synced
+    def syncState(self, calendar):
+        with self._lock:
+            row = self._db.execute('SELECT sync_token, synced_at FROM calendars WHERE url = ?',
+                                   (calendar,)).fetchone()
+        return row if row is not None else (None, None)
+
+    def setSyncState(self, calendar, sync_token, synced_at=None, ctag=None):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO calendars VALUES (?, ?, ?, ?)',
+                             (calendar, sync_token, synced_at or time.time(), ctag))
+    
+    # getctag of the calendar as of the last sync, or None
+    def ctag(self, calendar):
+        with self._lock:
+            row = self._db.execute('SELECT ctag FROM calendars WHERE url = ?', (calendar,)).fetchone()
+        return row[0] if row is not None else None
+
+    # {href: etag} of every event stored for the calendar
+    def etags(self, calendar):
+        with self._lock:
+            rows = self._db.execute('SELECT DISTINCT href, etag FROM events WHERE calendar = ?',
+                                    (calendar,)).fetchall()
+        return dict(rows)
+
+    # replace the events stored under href with the given parsed events
+    def put(self, calendar, href, etag, events):
+        rows = [self._row(calendar, href, etag, e) for e in events]
+        with self._lock, self._db:
+            self._indexes.pop(calendar, None)
+            self._db.execute('DELETE FROM events WHERE calendar = ? AND href = ?', (calendar, href))
+            self._db.executemany('INSERT INTO events VALUES ({})'.format(', '.join('?' * 14)), rows)
+
+    def delete(self, calendar, href):
+        with self._lock, self._db:
+            self._indexes.pop(calendar, None)
+            self._db.execute('DELETE FROM events WHERE calendar = ? AND href = ?', (calendar, href))
+
+    # forget everything about the calendar (e.g. when its sync token expired)
+    def reset(self, calendar):
+        with self._lock, self._db:
+            self._indexes.pop(calendar, None)
+            self._db.execute('DELETE FROM events WHERE calendar = ?', (calendar,))
+            self._db.execute('DELETE FROM calendars WHERE url = ?', (calendar,))
+
+    # widen [start, end) to midnight boundaries in the window's own timezone
+    def _wholeDays(self, start, end):
+        if isAllDay(start):
+            start = dt.combine(start, dtime(), tzinfo=self.tz)
+        if isAllDay(end):
+            end = dt.combine(end, dtime(), tzinfo=self.tz)
+        day_start = dt.combine(start.date(), dtime(), tzinfo=start.tzinfo)
+        day_end = dt.combine(end.date(), dtime(), tzinfo=end.tzinfo)
+        if day_end < end:
+            day_end += timedelta(1)
+        return day_start, day_end
+
+    # interval index of the calendar's single events; the caller holds self._lock
+    def _index(self, calendar):
+        index = self._indexes.get(calendar)
+        if index is None:
+            index = EventIndex(self._db.execute('''SELECT summary, start, end, all_day FROM events
+                                                   WHERE calendar = ? AND rrule IS NULL AND rdate IS NULL''',
+                                                (calendar,)))
+            self._indexes[calendar] = index
+        return index
+
+    # events of the calendar overlapping [start, end), in chronological order,
+    # with recurring events expanded into their occurrences
+    def search(self, calendar, start, end):
+        qstart, qend = self._toEpoch(start), self._toEpoch(end)
+        with self._lock:
+            rows = self._index(calendar).search(qstart, qend)
+            masters = self._db.execute('''SELECT href, etag, uid, summary, start, end, all_day,
+                                              tzid, rrule, rdate, exdate FROM events
+                                       WHERE calendar = ? AND (rrule IS NOT NULL OR rdate IS NOT NULL)
+                                       AND start < ? AND (until IS NULL OR until > ?)''',
+                                       (calendar, qend, qstart)).fetchall()
+            overrides = self._db.execute('''SELECT uid, recurrence_id FROM events
+                                         WHERE calendar = ? AND recurrence_id IS NOT NULL''',
+                                         (calendar,)).fetchall() if masters else []
+        events = [{'name': summary,
+                   'start': self._fromEpoch(s, all_day),
+                   'end': self._fromEpoch(e, all_day)} for summary, s, e, all_day in rows]
+        day_start, day_end = self._wholeDays(start, end)                        # expand whole days so windows that start
+        for row in masters:                                                     # "now" still hit the occurrence cache
+            href, etag = row[:2]
+            master, convert = self._masterFromRow(row[2:])
+            overridden = {convert(r) for uid, r in overrides if uid == master['uid']}
+            for s, e in self.occurrences.occurrences((calendar, href, etag, master['uid']),
+                                                     master, day_start, day_end, overridden):
+                if self._toEpoch(s) >= qend or self._toEpoch(e) <= qstart:
+                    continue
+                if not isAllDay(s):
+                    s, e = s.astimezone(self.tz), e.astimezone(self.tz)
+                events.append({'name': master['summary'], 'start': s, 'end': e})
+        events.sort(key=lambda e: startKey(e['start'], self.tz))
+        return events
+
+    def close(self):
+        with self._lock:
+            self._indexes.clear()
+            self._db.close()
@@ -0,0 +1,277 @@
+# Copyright 2021 M. Ditsworth
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import time
+from datetime import timezone
+from xml.etree import ElementTree
+
+from .ical import parseDateValue, parseDuration, parseEvents, splitContentLine, unfoldLines
+from .recurrence import isRecurring, ruleSet
+
+log = logging.getLogger(__name__)
+
+DAV = '{DAV:}'
+CALDAV = '{urn:ietf:params:xml:ns:caldav}'
+CS = '{http://calendarserver.org/ns/}'
+
+MULTIGET_BATCH = 100                                                            # hrefs per calendar-multiget REPORT
+
+SYNC_COLLECTION = """<?xml version="1.0" encoding="utf-8" ?>
+<d:sync-collection xmlns:d="DAV:">
+  <d:sync-token>{token}</d:sync-token>
+  <d:sync-level>1</d:sync-level>
+  <d:prop>
+    <d:getetag/>
+  </d:prop>
+</d:sync-collection>"""
+
+# VEVENT properties the skill reads; everything else (descriptions, attendees,
+# alarms, VTIMEZONE blocks) is left on the server
+EVENT_PROPS = ('UID', 'SUMMARY', 'DTSTART', 'DTEND', 'DURATION',
+               'RRULE', 'RDATE', 'EXDATE', 'RECURRENCE-ID')
+
+# RFC 4791 partial retrieval of calendar-data (section 9.6)
+CALENDAR_DATA = """<c:calendar-data>
+      <c:comp name="VCALENDAR">
+        <c:prop name="VERSION"/>
+        <c:comp name="VEVENT">
+{props}
+        </c:comp>
+      </c:comp>
+    </c:calendar-data>""".format(props='\n'.join('          <c:prop name="{}"/>'.format(p)
+                                                for p in EVENT_PROPS))
+
+CALENDAR_MULTIGET = """<?xml version="1.0" encoding="utf-8" ?>
+<c:calendar-multiget xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav">
+  <d:prop>
+    <d:getetag/>
+    {calendar_data}
+  </d:prop>
+{hrefs}
+</c:calendar-multiget>"""
+
+CALENDAR_QUERY = """<?xml version="1.0" encoding="utf-8" ?>
+<c:calendar-query xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav">
+  <d:prop>
+    <d:getetag/>
+    {calendar_data}
+  </d:prop>
+  <c:filter>
+    <c:comp-filter name="VCALENDAR">
+      <c:comp-filter name="VEVENT">
+        <c:time-range start="{start}" end="{end}"/>
+      </c:comp-filter>
+    </c:comp-filter>
+  </c:filter>
+</c:calendar-query>"""
+
+FREE_BUSY_QUERY = """<?xml version="1.0" encoding="utf-8" ?>
+<c:free-busy-query xmlns:c="urn:ietf:params:xml:ns:caldav">
+  <c:time-range start="{start}" end="{end}"/>
+</c:free-busy-query>"""
+
+
+# calendars of a home collection with their names and change tags, in one request
+CALENDAR_COLLECTIONS = """<?xml version="1.0" encoding="utf-8" ?>
+<d:propfind xmlns:d="DAV:" xmlns:cs="http://calendarserver.org/ns/">
+  <d:prop>
+    <d:resourcetype/>
+    <d:displayname/>
+    <cs:getctag/>
+  </d:prop>
+</d:propfind>"""
+
+
+# depth-0 PROPFIND of a calendar for just its ctag
+CALENDAR_CTAG = """<?xml version="1.0" encoding="utf-8" ?>
+<d:propfind xmlns:d="DAV:" xmlns:cs="http://calendarserver.org/ns/">
+  <d:prop>
+    <cs:getctag/>
+  </d:prop>
+</d:propfind>"""
+
+
+class SyncError(Exception):
+    pass
+
+
+# xml.sax.saxutils.escape pulls in urllib.request, which doubles the import time
+def escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+# yield (href, status, props) for every d:response of a multistatus body,
+# where props maps property tag to element for the 200 propstat
+def iterMultistatus(raw):
+    root = ElementTree.fromstring(raw)
+    for response in root.iter(DAV + 'response'):
+        href = response.findtext(DAV + 'href')
+        status = response.findtext(DAV + 'status')                              # set on the response itself for removed members
+        props = {}
+        for propstat in response.findall(DAV + 'propstat'):
+            if ' 200 ' in (propstat.findtext(DAV + 'status') or ''):
+                for prop in propstat.find(DAV + 'prop'):
+                    props[prop.tag] = prop
+        yield href, status, props
+
+
+# depth-1 PROPFIND of a calendar home, returning [(href, displayname, ctag)] for every
+# calendar in it
+def calendarCollections(client, home_url):
+    response = client.propfind(home_url, CALENDAR_COLLECTIONS, depth=1)
+    if response.status != 207:
+        raise SyncError('PROPFIND returned {}'.format(response.status))
+    calendars = []
+    for href, _, props in iterMultistatus(response.raw):
+        resourcetype = props.get(DAV + 'resourcetype')
+        if resourcetype is None or resourcetype.find(CALDAV + 'calendar') is None:
+            continue                                                            # the home itself, inboxes, task lists' parents
+        displayname = props.get(DAV + 'displayname')
+        ctag = props.get(CS + 'getctag')
+        calendars.append((href, displayname.text if displayname is not None else None,
+                          ctag.text if ctag is not None else None))
+    return calendars
+
+
+# the calendar's getctag (changes whenever anything in it does), or None if the server has none
+def calendarCTag(client, url):
+    response = client.propfind(url, CALENDAR_CTAG, depth=0)
+    if response.status != 207:
+        raise SyncError('PROPFIND returned {}'.format(response.status))
+    for _, _, props in iterMultistatus(response.raw):
+        ctag = props.get(CS + 'getctag')
+        if ctag is not None:
+            return ctag.text
+    return None
+
+
+# send a sync-collection REPORT, returning ({href: etag} changed, [href] removed, new token)
+def syncCollection(client, url, token):
+    from caldav.lib.error import AuthorizationError
+    try:
+        response = client.report(url, SYNC_COLLECTION.format(token=escape(token or '')), depth=0)
+    except AuthorizationError:                                                  # caldav raises on 403, which is how
+        if token:                                                               # sabre rejects an expired token
+            raise SyncError('sync token rejected')
+        raise
+    if response.status in (403, 409):                                           # valid-sync-token precondition failed
+        raise SyncError('sync token rejected')
+    if response.status != 207:
+        raise SyncError('sync-collection returned {}'.format(response.status))
+    changed, removed = {}, []
+    for href, status, props in iterMultistatus(response.raw):
+        if status is not None and ' 404 ' in status:
+            removed.append(href)
+        elif DAV + 'getetag' in props:
+            changed[href] = props[DAV + 'getetag'].text
+    root = ElementTree.fromstring(response.raw)
+    return changed, removed, root.findtext(DAV + 'sync-token')
+
+
+# fetch the calendar data of hrefs, yielding (href, etag, data)
+def calendarMultiget(client, url, hrefs):
+    hrefs = list(hrefs)
+    for i in range(0, len(hrefs), MULTIGET_BATCH):
+        body = '\n'.join('  <d:href>{}</d:href>'.format(escape(h)) for h in hrefs[i:i+MULTIGET_BATCH])
+        response = client.report(url, CALENDAR_MULTIGET.format(calendar_data=CALENDAR_DATA, hrefs=body),
+                                 depth=1)
+        if response.status != 207:
+            raise SyncError('calendar-multiget returned {}'.format(response.status))
+        for href, _, props in iterMultistatus(response.raw):
+            data = props.get(CALDAV + 'calendar-data')
+            if data is not None and data.text:
+                etag = props.get(DAV + 'getetag')
+                yield href, etag.text if etag is not None else None, data.text
+
+
+# time-range calendar-query returning only EVENT_PROPS (or whatever calendar_data
+# asks for), yielding (href, etag, data). start and end must be timezone aware.
+def calendarQuery(client, url, start, end, calendar_data=CALENDAR_DATA):
+    query = CALENDAR_QUERY.format(calendar_data=calendar_data,
+                                  start=start.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ'),
+                                  end=end.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ'))
+    response = client.report(url, query, depth=1)
+    if response.status != 207:
+        raise SyncError('calendar-query returned {}'.format(response.status))
+    for href, _, props in iterMultistatus(response.raw):
+        data = props.get(CALDAV + 'calendar-data')
+        if data is not None and data.text:
+            etag = props.get(DAV + 'getetag')
+            yield href, etag.text if etag is not None else None, data.text
+
+
+# RFC 4791 free-busy-query: busy (start, end) periods in UTC, without downloading any events
+def freeBusyQuery(client, url, start, end):
+    query = FREE_BUSY_QUERY.format(start=start.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ'),
+                                   end=end.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ'))
+    response = client.report(url, query, depth=1)
+    if response.status != 200:
+        raise SyncError('free-busy-query returned {}'.format(response.status))
+    busy = []
+    for line in unfoldLines(response.raw):
+        if not line.upper().startswith('FREEBUSY'):
+            continue
+        name, params, value = splitContentLine(line)
+        if name != 'FREEBUSY' or params.get('FBTYPE', 'BUSY').upper() == 'FREE':
+            continue
+        for period in value.strip().split(','):
+            first, second = period.split('/')
+            period_start = parseDateValue(first, {})
+            if second.startswith(('P', '+P', '-P')):
+                period_end = period_start + parseDuration(second)
+            else:
+                period_end = parseDateValue(second, {})
+            busy.append((period_start, period_end))
+    return busy
+
+
+# bring the stored copy of calendarObj up to date, downloading only what changed
+# since the last sync. A calendar whose ctag has not changed is not synced at all:
+# pass the ctag if it is already known (e.g. from calendarCollections), otherwise
+# it is asked for with a depth-0 PROPFIND. Returns the number of hrefs that were
+# fetched or removed.
+def syncCalendar(calendarObj, store, ctag=None):
+    client = calendarObj.client
+    url = str(calendarObj.url)
+    token, _ = store.syncState(url)
+    if ctag is None:
+        ctag = calendarCTag(client, url)
+    if token and ctag is not None and ctag == store.ctag(url):
+        store.setSyncState(url, token, time.time(), ctag)                       # still current as of now
+        return 0
+    try:
+        changed, removed, new_token = syncCollection(client, url, token)
+    except SyncError:
+        if not token:
+            raise
+        log.info('sync token for {} expired, doing a full sync'.format(url))
+        store.reset(url)
+        changed, removed, new_token = syncCollection(client, url, None)
+
+    known = store.etags(url)
+    stale = [href for href, etag in changed.items() if known.get(href) != etag]
+    for href in removed:
+        store.delete(url, href)
+    for href, etag, data in calendarMultiget(client, url, stale):
+        try:
+            events = list(parseEvents(data))
+            for e in events:
+                if isRecurring(e):
+                    ruleSet(e)                                                  # a bad RRULE would only fail in store.put
+        except Exception as e:                                                  # one bad object should not fail the sync
+            log.error('could not parse {}: {}'.format(href, e))
+            continue
+        store.put(url, href, etag, events)                                      # but the store failing should
+    store.setSyncState(url, new_token, time.time(), ctag)
+    return len(stale) + len(removed)
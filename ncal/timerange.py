@@ -0,0 +1,140 @@
+# Copyright 2021 M. Ditsworth
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import re
+import threading
+from datetime import date
+from datetime import datetime as dt
+from datetime import time as dtime
+from datetime import timedelta
+
+DAYS_OF_WEEK = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+MONTHS = ['january', 'february', 'march', 'april', 'may', 'june', 'july', 'august',
+          'september', 'october', 'november', 'december']
+PARTS_OF_DAY = {'morning': (6, 12), 'afternoon': (12, 18), 'evening': (18, 24)}  # [start hour, end hour)
+DATE_RE = re.compile(r'^(\d{1,2})\s*(?:st|nd|rd|th)?$')
+
+
+class TimeRangeResolver(object):
+    """Maps the grammar's time_frame phrases to [start, end) windows.
+
+    Days may be narrowed to a part of the day ("tomorrow afternoon"). Every
+    window is built from one reading of the injected clock and is
+    aligned to whole days (or parts of a day), so a resolved window stays
+    valid until midnight and is memoised until then. Weeks run Sunday to
+    Saturday. resolve() returns None for phrases it has no rule for.
+    """
+    def __init__(self, clock=None, tz=None):
+        self.tz = tz
+        self.clock = clock or (lambda: dt.now(self.tz))
+        self._lock = threading.Lock()
+        self._memo = {}
+        self._memoDay = None
+
+    def _at(self, day, hour=0):
+        if hour == 24:
+            return dt.combine(day + timedelta(1), dtime(), tzinfo=self.tz)
+        return dt.combine(day, dtime(hour), tzinfo=self.tz)
+
+    def _days(self, first, count):
+        return self._at(first), self._at(first + timedelta(count))
+
+    # the next date (today included) falling on weekday
+    def _upcoming(self, today, weekday):
+        return today + timedelta((weekday - today.weekday()) % 7)
+
+    def _day(self, today, modifier, word):
+        if word in ('day', 'today'):
+            return today + timedelta(1 if modifier == 'next' else 0)
+        if word == 'tomorrow':
+            return today + timedelta(1)
+        day = self._upcoming(today, DAYS_OF_WEEK.index(word))
+        return day + timedelta(7 if modifier == 'next' else 0)
+
+    def _week(self, today, modifier, word):
+        if word == 'week':
+            sunday = self._upcoming(today, 6)                                   # first day of next week
+            if modifier == 'next':
+                return self._days(sunday if sunday != today else sunday + timedelta(7), 7)
+            return self._at(today), self._at(sunday if sunday != today else sunday + timedelta(7))
+        # weekend: the coming saturday and sunday, or what is left of the current one
+        if today.weekday() == 6:
+            start = today
+        else:
+            start = self._upcoming(today, 5)
+        monday = start + timedelta(7 - start.weekday())
+        if modifier == 'next':
+            return self._at(monday + timedelta(5)), self._at(monday + timedelta(7))
+        return self._at(start), self._at(monday)
+
+    def _month(self, today, modifier, month, day_words):
+        year = today.year
+        if day_words:
+            match = DATE_RE.match(' '.join(day_words))
+            if match is None:
+                return None
+            try:
+                day = date(year, month, int(match.group(1)))
+                if day < today or modifier == 'next':
+                    day = date(year + 1, month, day.day)
+            except ValueError:                                                  # e.g. february 30th
+                return None
+            return self._days(day, 1)
+        if month < today.month or (month == today.month and modifier == 'next'):
+            year += 1
+        first = date(year, month, 1)
+        following = date(year + month // 12, month % 12 + 1, 1)
+        start = today if first <= today < following else first                  # the rest of the current month
+        return self._at(start), self._at(following)
+
+    # resolve without the memo
+    def _resolve(self, words, today):
+        modifier = None
+        if words and words[0] in ('this', 'next'):
+            modifier, words = words[0], words[1:]
+        if not words:
+            return None
+        word = words[0]
+        if len(words) == 1 and (word in ('day', 'today', 'tomorrow') or word in DAYS_OF_WEEK):
+            return self._days(self._day(today, modifier, word), 1)
+        if len(words) == 1 and word in ('week', 'weekend'):
+            return self._week(today, modifier, word)
+        if len(words) == 1 and word in PARTS_OF_DAY:
+            day = today + timedelta(1 if modifier == 'next' else 0)
+            start_hour, end_hour = PARTS_OF_DAY[word]
+            return self._at(day, start_hour), self._at(day, end_hour)
+        if word in MONTHS:
+            return self._month(today, modifier, MONTHS.index(word) + 1, words[1:])
+        if len(words) == 2 and words[1] in PARTS_OF_DAY and (word in ('today', 'tomorrow') or word in DAYS_OF_WEEK):
+            day = self._day(today, modifier, word)                              # e.g. "tomorrow afternoon", "friday morning"
+            start_hour, end_hour = PARTS_OF_DAY[words[1]]
+            return self._at(day, start_hour), self._at(day, end_hour)
+        return None
+
+    # (start, end) for a time_frame phrase such as "next week" or "march 3rd",
+    # or None if there is no rule for it
+    def resolve(self, time_frame):
+        if time_frame is None:
+            return None
+        key = ' '.join(time_frame.lower().split())
+        today = self.clock().date()
+        with self._lock:
+            if self._memoDay != today:                                          # windows are only valid until midnight
+                self._memo = {}
+                self._memoDay = today
+            if key in self._memo:
+                return self._memo[key]
+        window = self._resolve(key.split(), today)
+        with self._lock:
+            self._memo[key] = window
+        return window
@@ -0,0 +1,163 @@
+# Copyright 2021 M. Ditsworth
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import bisect
+import functools
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds in seconds, from a fast regex match up to a slow server round trip
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRIC = 'nextcloud_calendar_stage_seconds'
+
+log = logging.getLogger(__name__)
+
+
+class Histogram(object):
+    """Fixed-bucket latency histogram (Prometheus style)."""
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)                                  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    # estimate the q quantile (0..1) by interpolating inside its bucket
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+
+class Tracer(object):
+    """Times the stages of each intent into per (intent, stage) histograms.
+
+    trace(intent) marks the current thread as handling `intent` and records a
+    'total' span for it; span(stage) inside it records that stage. Work handed
+    to another thread keeps its intent by calling trace(intent, total=False)
+    with the value of current(). When `path` is given, the histograms are written
+    there in Prometheus text format after every traced intent.
+    """
+    def __init__(self, path=None, buckets=BUCKETS):
+        self.path = path
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def current(self):
+        return getattr(self._local, 'intent', None)
+
+    @contextmanager
+    def trace(self, intent, total=True):
+        previous = self.current()
+        self._local.intent = intent
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._local.intent = previous
+            if total:
+                self.observe(intent, 'total', time.perf_counter() - begin)
+                if self.path is not None and previous is None:
+                    try:
+                        self.write()
+                    except OSError as e:                                        # metrics must never fail the intent
+                        log.error('could not write {}: {}'.format(self.path, e))
+
+    @contextmanager
+    def span(self, stage):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            intent = self.current()
+            if intent is not None:                                              # untraced work (e.g. the prefetcher) is not timed
+                self.observe(intent, stage, time.perf_counter() - begin)
+
+    def observe(self, intent, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get((intent, stage))
+            if histogram is None:
+                histogram = self._histograms[(intent, stage)] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    # {intent: {stage: {count, mean_ms, p50_ms, p99_ms, max_ms}}}
+    def summary(self):
+        result = {}
+        with self._lock:
+            for (intent, stage), h in sorted(self._histograms.items()):
+                result.setdefault(intent, {})[stage] = {
+                    'count': h.count,
+                    'mean_ms': round(h.sum / h.count * 1000, 3),
+                    'p50_ms': round(h.quantile(0.5) * 1000, 3),
+                    'p99_ms': round(h.quantile(0.99) * 1000, 3),
+                    'max_ms': round(h.max * 1000, 3)}
+        return result
+
+    def prometheus(self):
+        lines = ['# HELP {} Latency of each stage of a skill intent.'.format(METRIC),
+                 '# TYPE {} histogram'.format(METRIC)]
+        with self._lock:
+            for (intent, stage), h in sorted(self._histograms.items()):
+                labels = 'intent="{}",stage="{}"'.format(intent, stage)
+                cumulative = 0
+                for bound, n in zip(self.buckets + ('+Inf',), h.counts):
+                    cumulative += n
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(METRIC, labels, bound, cumulative))
+                lines.append('{}_sum{{{}}} {}'.format(METRIC, labels, repr(h.sum)))
+                lines.append('{}_count{{{}}} {}'.format(METRIC, labels, h.count))
+        return '\n'.join(lines) + '\n'
+
+    # atomically replace the metrics file, so a scraper never reads half of it. Each
+    # write goes through its own temporary file, as intents finish on several threads
+    def write(self):
+        directory, name = os.path.split(os.path.abspath(self.path))
+        fObj = tempfile.NamedTemporaryFile('w', dir=directory, prefix=name + '.', suffix='.tmp', delete=False)
+        try:
+            with fObj:
+                fObj.write(self.prometheus())
+            os.chmod(fObj.name, 0o644)                                          # readable by the scraper, as open() made it
+            os.replace(fObj.name, self.path)
+        except OSError:
+            os.remove(fObj.name)
+            raise
+
+
+# method decorator: run the method inside self.tracer.trace(intent)
+def traced(intent):
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.tracer.trace(intent):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,67 @@
+# Copyright 2021 M. Ditsworth
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import hashlib
+
+CREATED = 'created'
+EXISTS = 'exists'                                                               # an identical event was already stored
+TRANSIENT = (401, 408, 423, 425, 429)                                           # 4xx worth retrying (401: until the password is fixed)
+
+
+class WriteError(Exception):
+    pass
+
+
+class Rejected(WriteError):
+    """The server refused the event for good; sending it again will not help."""
+    pass
+
+
+# UID derived from the event itself, so re-sending the same event hits the same resource
+def eventUID(name, start_utc, end_utc, rule=None):
+    key = '{}|{}|{}|{}'.format(name, start_utc, end_utc, rule or '')
+    return hashlib.sha1(bytes(key, 'utf-8')).hexdigest()
+
+
+# create uid.ics in the calendar unless it already exists (If-None-Match: *). Raises
+# Rejected for a 4xx that is not TRANSIENT, WriteError for anything else unexpected
+def putEvent(client, calendar_url, uid, ical):
+    from caldav.lib.error import AuthorizationError
+    url = '{}/{}.ics'.format(calendar_url.rstrip('/'), uid)
+    try:
+        response = client.put(url, ical, {'If-None-Match': '*',
+                                          'Content-Type': 'text/calendar; charset=utf-8'})
+    except AuthorizationError as e:                                             # caldav raises on 401 and 403
+        if getattr(e, 'reason', None) == 'Forbidden':
+            raise Rejected('PUT {} returned 403'.format(url)) from e
+        raise
+    if response.status in (201, 204):
+        return CREATED
+    if response.status == 412:                                                  # precondition failed: uid already there
+        return EXISTS
+    if 400 <= response.status < 500 and response.status not in TRANSIENT:
+        raise Rejected('PUT {} returned {}'.format(url, response.status))
+    raise WriteError('PUT {} returned {}'.format(url, response.status))
+
+
+# PUT every (uid, ical) concurrently on executor, returning [(uid, CREATED | EXISTS | exception)]
+# in the order given
+def putEvents(client, calendar_url, items, executor):
+    futures = [executor.submit(putEvent, client, calendar_url, uid, ical) for uid, ical in items]
+    results = []
+    for (uid, _), future in zip(items, futures):
+        try:
+            results.append((uid, future.result()))
+        except Exception as e:
+            results.append((uid, e))
+    return results
@@ -1 +1,7 @@
-from .calendarGrammar import CalendarGrammarParser as parser
+from .fastMatch import FastMatcher
+
+
+# the generated parser imports tatsu, so it is only loaded when a parser is built
+def parser(*args, **kwargs):
+    from .calendarGrammar import CalendarGrammarParser
+    return CalendarGrammarParser(*args, **kwargs)
@@ -224,6 +224,8 @@ class CalendarGrammarParser(Parser):
                 self._token('the')
                 with self._optional():
                     self._token('family')
+            with self._option():
+                self._token('family')
             self._error('no available options')
 
     @tatsumasu()
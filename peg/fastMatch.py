@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# Single-pass matcher for the common utterances, compiled from
+# calendarGrammar.ebnf into one regular expression.
+#
+# The grammar only uses literals, /regex/ patterns, optionals, groups, choices
+# and named captures, so every rule can be inlined into a regex. Tokens get the
+# same whitespace skipping and name guard TatSu applies. Anything the regex
+# does not match is left to the full PEG parser.
+import os
+import re
+
+GRAMMAR_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calendarGrammar.ebnf')
+
+TOKEN_RE = re.compile(r'''
+    \s+ | \#[^\n]* | @@[^\n]*                 # whitespace, comments, directives
+  | (?P<string>'[^']*'|"[^"]*")
+  | (?P<regex>/(?:\\.|[^/])*/)
+  | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<op>[=;|\[\]():])
+''', re.VERBOSE)
+
+
+class GrammarError(Exception):
+    pass
+
+
+def tokenize(text):
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        match = TOKEN_RE.match(text, pos)
+        if match is None:
+            raise GrammarError('unexpected {!r} at {}'.format(text[pos:pos+10], pos))
+        pos = match.end()
+        for kind in ('string', 'regex', 'name', 'op'):
+            if match.group(kind) is not None:
+                tokens.append((kind, match.group(kind)))
+    return tokens
+
+
+# {rule name: token list of its right hand side}
+def readRules(text):
+    rules = {}
+    tokens = tokenize(text)
+    i = 0
+    while i < len(tokens):
+        name, eq = tokens[i], tokens[i+1]
+        if name[0] != 'name' or eq != ('op', '='):
+            raise GrammarError('expected a rule at token {}'.format(i))
+        j = tokens.index(('op', ';'), i)
+        rules[name[1]] = tokens[i+2:j]
+        i = j + 1
+    return rules
+
+
+class RegexTranslator(object):
+    """Recursive descent over the rule bodies, emitting regex source."""
+    def __init__(self, rules):
+        self.rules = rules
+        self.captures = {}                                                      # capture name -> regex group names used for it
+
+    def rule(self, name, depth=0):
+        if depth > 20:
+            raise GrammarError('rule {} is recursive'.format(name))
+        tokens = self.rules[name]
+        source, pos = self.choice(tokens, 0, depth)
+        if pos != len(tokens):
+            raise GrammarError('could not translate rule {}'.format(name))
+        return source
+
+    def choice(self, tokens, pos, depth):
+        if pos < len(tokens) and tokens[pos] == ('op', '|'):                   # leading | is allowed
+            pos += 1
+        options = []
+        while True:
+            source, pos = self.sequence(tokens, pos, depth)
+            options.append(source)
+            if pos < len(tokens) and tokens[pos] == ('op', '|'):
+                pos += 1
+                continue
+            return '(?:{})'.format('|'.join(options)), pos
+
+    def sequence(self, tokens, pos, depth):
+        parts = []
+        while pos < len(tokens) and tokens[pos] not in (('op', '|'), ('op', ']'), ('op', ')')):
+            source, pos = self.element(tokens, pos, depth)
+            parts.append(source)
+        return ''.join(parts), pos
+
+    def element(self, tokens, pos, depth):
+        kind, value = tokens[pos]
+        if kind == 'name' and pos + 1 < len(tokens) and tokens[pos+1] == ('op', ':'):
+            groups = self.captures.setdefault(value, [])
+            group = '{}__{}'.format(value, len(groups))                         # python regexes cannot repeat a group name
+            groups.append(group)
+            source, pos = self.element(tokens, pos + 2, depth)
+            return '(?P<{}>{})'.format(group, source), pos
+        if kind == 'string':
+            literal = value[1:-1]
+            guard = r'(?!\w)' if literal[-1:].isalnum() else ''                # TatSu's name guard
+            return r'\s*' + re.escape(literal) + guard, pos + 1
+        if kind == 'regex':
+            return r'\s*(?:{})'.format(value[1:-1]), pos + 1
+        if kind == 'name':
+            return self.rule(value, depth + 1), pos + 1
+        if (kind, value) in (('op', '['), ('op', '(')):
+            close = ']' if value == '[' else ')'
+            source, pos = self.choice(tokens, pos + 1, depth)
+            if tokens[pos] != ('op', close):
+                raise GrammarError('expected {}'.format(close))
+            return source + ('?' if close == ']' else ''), pos + 1
+        raise GrammarError('unexpected token {}'.format(value))
+
+
+class FastMatcher(object):
+    """Pulls calendar_owner and time_frame out of an utterance in one regex
+    match. match() returns {capture: phrase} with multi-word captures joined
+    by single spaces, or None when the utterance needs the PEG parser.
+    """
+    def __init__(self, grammar_file=GRAMMAR_FILE, start='start'):
+        with open(grammar_file, 'r') as fObj:
+            translator = RegexTranslator(readRules(fObj.read()))
+        self.regex = re.compile(translator.rule(start))
+        self.captures = translator.captures
+
+    def match(self, text):
+        m = self.regex.match(text)
+        if m is None:
+            return None
+        result = {}
+        for name, groups in self.captures.items():
+            for group in groups:
+                if m.group(group) is not None:
+                    result[name] = ' '.join(m.group(group).split())
+                    break
+        return result
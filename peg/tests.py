@@ -1,40 +1,158 @@
 # -*- coding: utf-8 -*-
-import json
-from tatsu import parse
+# Accuracy and speed harness for the calendar grammar.
+#
+# Builds a labelled corpus of utterances from the grammar's vocabulary and runs
+# it through the pre-generated parser (calendarGrammar.py), a parser compiled
+# at runtime from calendarGrammar.ebnf, and the regex fast matcher. Reports
+# owner/time frame accuracy, p50/p99 latency, throughput and peak memory, and
+# exits non-zero if any parser gets an utterance wrong or is slower than the
+# given p99 budget, so grammar changes can be gated on both.
+#
+#   python tests.py [--size 5000] [--max-p99-ms 5] [--verbose]
+import argparse
+import itertools
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+from tatsu import compile as compile_grammar
 from tatsu.util import asjson
 
+from calendarGrammar import CalendarGrammarParser
+from fastMatch import FastMatcher
+
+INITS = ['what is', 'what is on', 'what am', 'what does', 'what are', 'how busy is', 'how busy am',
+         'tell me', 'tell me about', 'add an event to', 'put something on',
+         'schedule a meeting on', 'create appointment to']
+OWNERS = ['me', 'i', 'my', 'my lowe', 'my low', 'madison', 'milo', 'the', 'the family', 'family']
+CALENDARS = ['', 'calendar', 'agenda', 'schedule', 'planner', 'events', 'up to', 'doing',
+             'have going', 'calendar on', 'schedule on', 'have going on']
+TIMES = ['day', 'weekend', 'week', 'afternoon', 'evening', 'morning', 'tomorrow', 'today',
+         'sunday', 'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday',
+         'march', 'may', 'march 3rd', 'june 12th', 'december 1st', 'october 22']
+MODIFIERS = ['', 'this', 'next']
+TRAILERS = ['', 'at 3pm', 'for an hour']                                         # left unparsed, as in real utterances
+
+ORDINAL_RE = re.compile(r'(\d) (st|nd|rd|th)\b')
+
+# the original hand-written examples, kept as fixed regression cases
+EXAMPLES = [("create an event on my calendar on wednesday at 4pm", 'my', 'wednesday'),
+            ("schedule an appointment on madison's schedule tomorrow at noon", 'madison', 'tomorrow'),
+            ("put something on milo's calendar on friday at 11 am", 'milo', 'friday'),
+            ("what am i up to this week", 'i', 'this week'),
+            ("what does madison have going on today", 'madison', 'today'),
+            ("what is on my schedule today", 'my', 'today'),
+            ("how busy am i today", 'i', 'today'),
+            ("what is milo up to this week", 'milo', 'this week'),
+            ("what is on my schedule next week", 'my', 'next week'),
+            ("what are madison's events tomorrow", 'madison', 'tomorrow'),
+            ("tell me my schedule tomorrow", 'my', 'tomorrow'),
+            ("tell me my lowe schedule next week", 'my lowe', 'next week'),
+            ("add an event to my calendar on march 3rd at 3pm", 'my', 'march 3rd'),
+            ("what is on the family calendar tomorrow", 'the family', 'tomorrow'),
+            # as mycroft's normalize() passes them on when it drops articles
+            ("what is on family calendar tomorrow", 'family', 'tomorrow'),
+            ("how busy is family this week", 'family', 'this week'),
+            ("tell me family schedule this weekend", 'family', 'this weekend')]
+
+
+# the skill joins multi-word PEG matches into phrases; the fast matcher returns phrases
+def joinTokens(value):
+    if type(value) == list:
+        return ORDINAL_RE.sub(r'\1\2', ' '.join(joinTokens(v) for v in value))
+    return value
+
+
+# (utterance, owner, time frame) for a random sample of the grammar's phrasings
+def buildCorpus(size, seed=0):
+    corpus = [(u.replace("'s", ""), o, t) for u, o, t in EXAMPLES]
+    combos = list(itertools.product(INITS, OWNERS, CALENDARS, MODIFIERS, TIMES))
+    rand = random.Random(seed)
+    for init, owner, calendar, modifier, when in rand.sample(combos, min(size, len(combos))):
+        timeframe = ' '.join(w for w in (modifier, when) if w)
+        words = [init, owner, calendar, timeframe, rand.choice(TRAILERS)]
+        corpus.append((' '.join(w for w in words if w), owner, timeframe))
+    return corpus
+
 
-tests = '''create an event on my calendar on wednesday at 4pm
-schedule an appointment on madison's schedule tomorrow at noon
-put something on milo's calendar on friday at 11 am
-what am i up to this week
-what does madison have going on today
-what is on my schedule today
-what is on my schedule today
-how busy am i today
-what is milo up to this week
-what is on my schedule next week
-what are madison's events tomorrow
-tell me my schedule tomorrow
-tell me my lowe schedule next week
-add an event to my calendar on march 3rd at 3pm'''
+def pegParse(parser):
+    def parse(text):
+        ast = asjson(parser.parse(text))
+        return joinTokens(ast.get('calendar_owner')), joinTokens(ast.get('time_frame'))
+    return parse
 
 
-test_lines = tests.split('\n')
+def fastParse(matcher):
+    def parse(text):
+        result = matcher.match(text)
+        if result is None:
+            return None
+        return result.get('calendar_owner'), result.get('time_frame')
+    return parse
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+# run the corpus through parse, returning a stats dict
+def run(name, parse, corpus, verbose=False):
+    latencies = []
+    wrong = undecided = 0
+    tracemalloc.start()
+    begin = time.perf_counter()
+    for text, owner, timeframe in corpus:
+        t = time.perf_counter()
+        try:
+            result = parse(text)
+        except Exception:
+            result = ('<parse error>', None)
+        latencies.append(time.perf_counter() - t)
+        if result is None:                                                     # fast matcher defers to the PEG parser
+            undecided += 1
+        elif result != (owner, timeframe):
+            wrong += 1
+            if verbose:
+                print("  {}: '{}' -> {} expected {}".format(name, text, result, (owner, timeframe)))
+    total = time.perf_counter() - begin
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'name': name, 'n': len(corpus), 'wrong': wrong, 'undecided': undecided,
+            'p50': percentile(latencies, 50) * 1000, 'p99': percentile(latencies, 99) * 1000,
+            'throughput': len(corpus) / total, 'peak_kb': peak / 1024.0}
+
 
 def main():
+    args = argparse.ArgumentParser(description=__doc__)
+    args.add_argument('--size', type=int, default=5000, help='number of generated utterances')
+    args.add_argument('--max-p99-ms', type=float, default=None, help='fail if any parser p99 exceeds this')
+    args.add_argument('--verbose', action='store_true', help='print every wrong parse')
+    args = args.parse_args()
+
+    corpus = buildCorpus(args.size)
     with open('calendarGrammar.ebnf', 'r') as fObj:
         GRAMMAR = fObj.read()
-    
-    for x in test_lines:
-        print("line: '{}'".format(x))
-        ast = asjson(parse(GRAMMAR, x.replace("'s","")))
-        print('calendar owner:  {}'.format(ast['calendar_owner']))
-        print('time frame: {}'.format(ast['time_frame']))
-        print()
-        
+    begin = time.perf_counter()
+    compiled = compile_grammar(GRAMMAR)
+    print('runtime grammar compile: {:.1f} ms'.format((time.perf_counter() - begin) * 1000))
 
+    results = [run('generated', pegParse(CalendarGrammarParser()), corpus, args.verbose),
+               run('compiled', pegParse(compiled), corpus, args.verbose),
+               run('fastmatch', fastParse(FastMatcher()), corpus, args.verbose)]
 
-if __name__ == '__main__':
-    main()
+    print('{:<10} {:>6} {:>6} {:>9} {:>8} {:>8} {:>10} {:>9}'.format(
+          'parser', 'n', 'wrong', 'undecided', 'p50 ms', 'p99 ms', 'utt/s', 'peak KB'))
+    failed = False
+    for r in results:
+        print('{name:<10} {n:>6} {wrong:>6} {undecided:>9} {p50:>8.3f} {p99:>8.3f} '
+              '{throughput:>10.0f} {peak_kb:>9.0f}'.format(**r))
+        if r['wrong'] or (args.max_p99_ms is not None and r['p99'] > args.max_p99_ms):
+            failed = True
+    return 1 if failed else 0
 
+
+if __name__ == '__main__':
+    sys.exit(main())